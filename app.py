@@ -1,32 +1,66 @@
 import os
 from dotenv import load_dotenv
-from flask import Flask, request, Response, stream_with_context, jsonify
+load_dotenv()  # before local imports, which read their settings at import time
+from flask import Flask, request, Response, jsonify, g
 from flask_cors import CORS
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import (
     JWTManager, create_access_token, jwt_required, get_jwt_identity
 )
 from bson import ObjectId
-from ollama_chat import stream_gemma_response
+import threading
+from chat_service import ChatTurn, run_turn
+from scheduler import scheduler, SchedulerRejected
+from ollama_chat import start_model_warmup
+from indexes import ensure_indexes
+from stream_buffer import create_buffer, get_buffer, parse_last_event_id, format_replay_frame
+import metrics
+from pagination import page_size, next_cursor, InvalidCursor
+from mongo import command_count
+from json_provider import FastJSONProvider
 from db import (
     get_all_chats, save_user, get_user_by_username, get_user_by_email, get_or_create_oauth_user,
-    create_empty_chat_session, append_message_to_session, get_user_sessions, get_session_by_id, get_active_session
+    create_empty_chat_session, get_user_sessions, get_session_by_id,
+    get_active_session_id, get_session_messages
 )
 from oauth_config import verify_google_token
 from emotion import bp as emotion_bp
 from journal import bp as journal_bp
 from planner import bp as planner_bp
+from search import bp as search_bp
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)  # ObjectId/datetime aware, orjson-backed
 CORS(app)
 bcrypt = Bcrypt(app)
-load_dotenv()
 app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
+# Request bodies are small JSON everywhere except the bulk imports, which set their own limit
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_CONTENT_LENGTH", str(1024 * 1024)))
 jwt = JWTManager(app)
 
 app.register_blueprint(emotion_bp)
 app.register_blueprint(journal_bp)
 app.register_blueprint(planner_bp)
+app.register_blueprint(search_bp)
+
+# Idempotent, so every worker can run it at startup
+ensure_indexes()
+
+# MongoDB round trips per request, by endpoint (streamed bodies are not included)
+mongo_round_trips = metrics.Histogram(
+    "http_request_mongo_commands", "MongoDB commands sent while handling a request",
+    labels=("endpoint",), buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50)
+)
+
+@app.before_request
+def start_counting_commands():
+    g.mongo_commands = command_count()
+
+@app.after_request
+def record_commands(response):
+    if "mongo_commands" in g:
+        mongo_round_trips.observe(command_count() - g.mongo_commands, endpoint=request.endpoint or "")
+    return response
 
 # ✅ SIGNUP
 @app.route("/signup", methods=["POST"])
@@ -122,47 +156,109 @@ def chat():
     if not user_msg or not session_id:
         return jsonify({"error": "No message or session_id provided"}), 400
 
-    # Append user message, get session so far, build prompt
-    append_message_to_session(session_id, "user", user_msg)
-    session = get_session_by_id(session_id)
-    prompt = "You are a kind and empathetic mental health bot, all you need to do is reply to the user's message kindly.\n"
-    for msg in session["messages"]:
-        if msg["sender"] == "user":
-            prompt += f"User: {msg['text']}\n"
-        else:
-            prompt += f"AI: {msg['text']}\n"
-    prompt += "AI:"
+    # Wait for a stream slot, or fail fast when the backend is saturated
+    try:
+        queue_wait = scheduler.acquire(user_id)
+    except SchedulerRejected as e:
+        return jsonify({"error": str(e)}), e.status, {"Retry-After": str(e.retry_after)}
+
+    try:
+        # Append user message, get session so far, build prompt
+        turn = ChatTurn(user_id, session_id, user_msg).prepare()
+        if turn is None:
+            scheduler.release(user_id)
+            return jsonify({"error": "Session not found"}), 404
+        buffer = create_buffer(user_id)
+    except Exception:
+        scheduler.release(user_id)
+        raise
+
+    # Generate in the background so a dropped connection can resume from the buffer
+    def produce():
+        try:
+            run_turn(turn, buffer)
+        finally:
+            scheduler.release(user_id)
+    threading.Thread(target=produce, name=f"chat-{buffer.stream_id}", daemon=True).start()
+
+    response = replay_response(buffer, 0)
+    response.headers["X-Queue-Time"] = f"{queue_wait:.3f}"
+    return response
+
+# ✅ RESUME A CHAT STREAM after a dropped connection (SSE Last-Event-ID)
+@app.route("/chat/stream/<stream_id>", methods=["GET"])
+@jwt_required()
+def resume_chat(stream_id):
+    buffer = get_buffer(stream_id, get_jwt_identity())
+    if not buffer:
+        return jsonify({"error": "Stream not found or expired"}), 404
+    offset = parse_last_event_id(request.headers.get("Last-Event-ID", request.args.get("last_event_id")))
+    return replay_response(buffer, offset)
+
+def replay_response(buffer, offset):
     def generate():
-        full_reply = ""
-        for chunk in stream_gemma_response(prompt):
-            full_reply += chunk
-            yield f"data: {chunk}\n\n"
-        append_message_to_session(session_id, "bot", full_reply)
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
-
-# ✅ PER-USER HISTORY (all sessions)
+        for index, frame in buffer.iter_frames(offset):
+            yield format_replay_frame(index, frame)
+    buffer.attach()
+    response = Response(generate(), mimetype='text/event-stream')
+    # The server closes the response when the stream ends or the client disconnects
+    response.call_on_close(buffer.detach)
+    response.headers["X-Stream-Id"] = buffer.stream_id
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# ✅ PER-USER HISTORY (session summaries, newest first; pass ?cursor=<next_cursor> for the next page)
+# Messages are loaded per session from /sessions/<session_id>/messages when one is opened
 @app.route("/history", methods=["GET"])
 @jwt_required()
 def history():
     user_id = get_jwt_identity()
-    sessions = get_user_sessions(user_id)
-    # Format for frontend: id, timestamp, first user message, last message time
-    formatted = []
-    for s in sessions:
-        if not s["messages"]:
-            continue
-        formatted.append({
-            "session_id": str(s["_id"]),
-            "timestamp": s["timestamp"].isoformat() if "timestamp" in s else "",
-            "first_user_message": next((m["text"] for m in s["messages"] if m["sender"] == "user"), ""),
-            "last_message_time": s["messages"][-1]["timestamp"].isoformat() if s["messages"] else "",
-            "messages": s["messages"]
-        })
-    # Most recent first
-    formatted.sort(key=lambda x: x["timestamp"], reverse=True)
-    return jsonify(formatted)
+    limit = page_size(request.args.get("limit"))
+    try:
+        sessions = get_user_sessions(user_id, request.args.get("cursor"), limit)
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
+    active_session_id = get_active_session_id(user_id)
+    formatted = [{
+        "session_id": s["_id"],
+        "timestamp": s.get("timestamp", ""),
+        "first_user_message": s.get("first_user_message", ""),
+        "last_message_time": s.get("last_message_time", ""),
+        "message_count": s["message_count"],
+        "active": s["_id"] == active_session_id
+    } for s in sessions]
+    return jsonify({"sessions": formatted, "next_cursor": next_cursor(sessions, "timestamp", limit)})
+
+# ✅ MESSAGES OF ONE SESSION (paged, oldest first; pass ?before=<seq> for older pages)
+@app.route("/sessions/<session_id>/messages", methods=["GET"])
+@jwt_required()
+def session_messages(session_id):
+    user_id = get_jwt_identity()
+    if not ObjectId.is_valid(session_id):
+        return jsonify({"error": "Session not found"}), 404
+    session = get_session_by_id(session_id)
+    if not session or str(session["user_id"]) != user_id:
+        return jsonify({"error": "Session not found"}), 404
+
+    before = request.args.get("before", type=int)
+    limit = page_size(request.args.get("limit"), 50, maximum=200)
+    page = get_session_messages(session_id, before_seq=before, limit=limit, newest_first=True)[::-1]
+    return jsonify({
+        "messages": page,
+        # seq to pass as ?before= for the next (older) page, None once the start is reached
+        "next_before": page[0]["seq"] if page and page[0]["seq"] > 1 else None
+    })
+
+# ✅ METRICS (Prometheus text format)
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
+    # Load the model on every backend before users hit it. Not done at import, so scripts
+    # that import the app don't start talking to Ollama; under other servers the lifespan
+    # hook (asgi.py) or the first chat stream starts it
+    start_model_warmup()
     app.run(port=5000, debug=True)
 
 
@@ -0,0 +1,172 @@
+"""ASGI entry point: `uvicorn asgi:application --workers 2`
+
+POST /chat and its resume route are served natively on the event loop,
+so a long generation holds a coroutine instead of a worker thread. Every
+other route falls through to the Flask app and its blueprints via
+a2wsgi's WSGIMiddleware.
+"""
+import json
+import asyncio
+from urllib.parse import parse_qsl
+from a2wsgi import WSGIMiddleware
+from flask_jwt_extended import decode_token
+from app import app as flask_app
+from chat_service import ChatTurn, arun_turn
+from ollama_chat import close_async_client, start_model_warmup
+from scheduler import scheduler, SchedulerRejected
+from stream_buffer import create_buffer, get_buffer, parse_last_event_id, format_replay_frame
+from json_provider import dumps_bytes
+
+wsgi_app = WSGIMiddleware(flask_app)
+
+# Matches flask_cors' default of allowing any origin
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+
+# Strong references to running producers so they aren't garbage collected
+_producers = set()
+
+
+async def _read_body(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+async def _send_json(send, status, payload, headers=()):
+    body = dumps_bytes(payload)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json")] + CORS_HEADERS + list(headers)
+    })
+    await send({"type": "http.response.body", "body": body})
+
+def _get_identity(scope):
+    """Decode the bearer token the same way @jwt_required() does"""
+    headers = dict(scope["headers"])
+    auth = headers.get(b"authorization", b"").decode()
+    if not auth.startswith("Bearer "):
+        return None
+    with flask_app.app_context():
+        try:
+            return decode_token(auth[len("Bearer "):])["sub"]
+        except Exception:
+            return None
+
+async def chat(scope, receive, send):
+    user_id = _get_identity(scope)
+    if not user_id:
+        return await _send_json(send, 401, {"msg": "Missing or invalid Authorization header"})
+
+    try:
+        data = json.loads(await _read_body(receive) or b"{}")
+    except ValueError:
+        return await _send_json(send, 400, {"error": "Invalid JSON body"})
+    user_msg = data.get("message", "")
+    session_id = data.get("session_id")
+    if not user_msg or not session_id:
+        return await _send_json(send, 400, {"error": "No message or session_id provided"})
+
+    # Queued requests wait on the event loop, so they never tie up executor threads
+    try:
+        queue_wait = await scheduler.aacquire(user_id)
+    except SchedulerRejected as e:
+        return await _send_json(send, e.status, {"error": str(e)}, [(b"retry-after", str(e.retry_after).encode())])
+
+    try:
+        # Mongo calls are short; run them on the default executor
+        turn = await asyncio.to_thread(ChatTurn(user_id, session_id, user_msg).prepare)
+        if turn is None:
+            scheduler.release(user_id)
+            return await _send_json(send, 404, {"error": "Session not found"})
+        buffer = create_buffer(user_id)
+    except BaseException:
+        scheduler.release(user_id)
+        raise
+
+    # Generate in a task of its own so a dropped connection can resume from the buffer
+    async def produce():
+        try:
+            await arun_turn(turn, buffer)
+        finally:
+            scheduler.release(user_id)
+    task = asyncio.create_task(produce())
+    _producers.add(task)
+    task.add_done_callback(_producers.discard)
+
+    await _send_replay(send, buffer, 0, receive=receive, headers=[(b"x-queue-time", f"{queue_wait:.3f}".encode())])
+
+async def resume_chat(scope, receive, send, stream_id):
+    user_id = _get_identity(scope)
+    if not user_id:
+        return await _send_json(send, 401, {"msg": "Missing or invalid Authorization header"})
+    buffer = get_buffer(stream_id, user_id)
+    if not buffer:
+        return await _send_json(send, 404, {"error": "Stream not found or expired"})
+    last_event_id = dict(scope["headers"]).get(b"last-event-id", b"").decode() or None
+    if last_event_id is None:
+        query = dict(parse_qsl(scope.get("query_string", b"").decode()))
+        last_event_id = query.get("last_event_id")
+    await _send_replay(send, buffer, parse_last_event_id(last_event_id), receive=receive)
+
+async def _send_replay(send, buffer, offset, receive, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-stream-id", buffer.stream_id.encode())
+        ] + CORS_HEADERS + list(headers)
+    })
+
+    async def replay():
+        async for index, frame in buffer.aiter_frames(offset):
+            await send({"type": "http.response.body", "body": format_replay_frame(index, frame).encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    # send() doesn't fail once the client is gone, so watch for the disconnect message
+    buffer.attach()
+    try:
+        replay_task = asyncio.ensure_future(replay())
+        disconnect_task = asyncio.ensure_future(_wait_for_disconnect(receive))
+        await asyncio.wait({replay_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+        disconnect_task.cancel()
+        if not replay_task.done():
+            replay_task.cancel()
+        else:
+            replay_task.result()
+    finally:
+        buffer.detach()
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Covers servers that import the app before forking workers
+            start_model_warmup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+RESUME_PREFIX = "/chat/stream/"
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["path"] == "/chat" and scope["method"] == "POST":
+        return await chat(scope, receive, send)
+    if scope["type"] == "http" and scope["path"].startswith(RESUME_PREFIX) and scope["method"] == "GET":
+        return await resume_chat(scope, receive, send, scope["path"][len(RESUME_PREFIX):])
+    return await wsgi_app(scope, receive, send)
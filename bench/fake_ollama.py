@@ -0,0 +1,137 @@
+"""Fake Ollama server for benchmarking the chat path without a GPU.
+
+Streams NDJSON from /api/generate at a configurable token rate, answers
+load-only (keep_alive) requests and /api/tags health probes.
+
+    python bench/fake_ollama.py --ports 11500,11501 --tokens 150 --token-rate 40
+
+then start the app with OLLAMA_HOSTS=http://127.0.0.1:11500,http://127.0.0.1:11501
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CHARS_PER_TOKEN = 4
+
+
+def make_handler(options):
+    loaded = threading.Event()
+
+    class FakeOllamaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            if options.verbose:
+                super().log_message(format, *args)
+
+        def _send_json(self, payload, status=200):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _load_model(self):
+            """Sleep for the load time on the first request only, like a cold model"""
+            if loaded.is_set():
+                return 0
+            time.sleep(options.load_time)
+            loaded.set()
+            return int(options.load_time * 1e9)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                return self._send_json({"models": [{"name": options.model}]})
+            self._send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            if self.path != "/api/generate":
+                return self._send_json({"error": "not found"}, 404)
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            load_duration = self._load_model()
+            prompt = body.get("prompt", "")
+
+            if not prompt or body.get("stream") is False:
+                return self._send_json({"model": options.model, "response": "", "done": True,
+                                        "done_reason": "load", "load_duration": load_duration})
+
+            # Prompt evaluation cost grows with the prompt; a reused context only pays for new text
+            prompt_tokens = len(prompt) // CHARS_PER_TOKEN + 1
+            prompt_eval = prompt_tokens / options.prompt_eval_rate
+            time.sleep(options.first_token_latency + prompt_eval)
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            started = time.monotonic()
+            # Tokens sent before the connection drops; at most all of them, so the final frame is lost
+            fail_at = random.randint(1, options.tokens) if random.random() < options.fail_rate else None
+            try:
+                for i in range(options.tokens):
+                    self._write_chunk({"model": options.model, "response": f"word{i} ", "done": False})
+                    if fail_at == i + 1:
+                        # Drop the connection mid-stream like a crashed host
+                        self.close_connection = True
+                        return
+                    time.sleep(1 / options.token_rate)
+                eval_duration = int((time.monotonic() - started) * 1e9)
+                context = list(body.get("context") or []) + list(range(prompt_tokens + options.tokens))
+                self._write_chunk({
+                    "model": options.model, "response": "", "done": True, "done_reason": "stop",
+                    "context": context,
+                    "load_duration": load_duration,
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int(prompt_eval * 1e9),
+                    "eval_count": options.tokens,
+                    "eval_duration": eval_duration,
+                    "total_duration": eval_duration + int(prompt_eval * 1e9) + load_duration
+                })
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # Client went away: stop generating, as Ollama does
+                self.close_connection = True
+
+        def _write_chunk(self, payload):
+            line = json.dumps(payload).encode() + b"\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.flush()
+
+    return FakeOllamaHandler
+
+
+def serve(port, options):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(options))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ports", default="11500", help="comma-separated ports, one fake host per port")
+    parser.add_argument("--model", default="phi")
+    parser.add_argument("--tokens", type=int, default=150, help="tokens per reply")
+    parser.add_argument("--token-rate", type=float, default=40, help="tokens per second while generating")
+    parser.add_argument("--first-token-latency", type=float, default=0.05, help="fixed seconds before the first token")
+    parser.add_argument("--prompt-eval-rate", type=float, default=2000, help="prompt tokens evaluated per second")
+    parser.add_argument("--load-time", type=float, default=2.0, help="seconds to 'load' the model on first use")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of streams dropped mid-reply")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    servers = [serve(int(port), options) for port in options.ports.split(",")]
+    print(f"Fake Ollama listening on {', '.join(f'http://127.0.0.1:{s.server_port}' for s in servers)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
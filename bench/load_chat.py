@@ -0,0 +1,197 @@
+"""Load generator for the /chat streaming path.
+
+Signs up users, starts a chat session for each and drives concurrent
+/chat streams against a running app, then reports p50/p95/p99 time to
+first token, full-reply latency and throughput, compared against a
+stored baseline.
+
+    python bench/load_chat.py --base-url http://127.0.0.1:5000 --users 20 --turns 3
+    python bench/load_chat.py ... --save-baseline     # record the current numbers
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Metrics where a higher value is better; every other metric is a latency
+HIGHER_IS_BETTER = {"replies_per_second", "frames_per_second"}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def create_user(base_url, run_id, index):
+    http = requests.Session()
+    credentials = {"username": f"bench-{run_id}-{index}", "password": "bench-password"}
+    http.post(f"{base_url}/signup", json=credentials).raise_for_status()
+    response = http.post(f"{base_url}/login", json=credentials)
+    response.raise_for_status()
+    http.headers["Authorization"] = f"Bearer {response.json()['token']}"
+    session_id = http.post(f"{base_url}/start_session").json()["session_id"]
+    return http, session_id
+
+
+def run_turn(http, base_url, session_id, message, timeout):
+    """Send one chat message and time the streamed reply"""
+    started = time.monotonic()
+    result = {"status": None, "ttft": None, "total": None, "frames": 0, "bytes": 0, "error": False}
+    try:
+        with http.post(f"{base_url}/chat", json={"message": message, "session_id": session_id},
+                       stream=True, timeout=timeout) as response:
+            result["status"] = response.status_code
+            if response.status_code != 200:
+                return result
+            in_event = False
+            for line in response.iter_lines():
+                if line.startswith(b"event: error"):
+                    result["error"] = True
+                if line.startswith(b"data:"):
+                    if result["ttft"] is None:
+                        result["ttft"] = time.monotonic() - started
+                    # A multi-line token is one event with several data: lines
+                    in_event = True
+                    result["bytes"] += len(line)
+                elif not line and in_event:
+                    result["frames"] += 1
+                    in_event = False
+    except requests.RequestException:
+        result["error"] = True
+        return result
+    result["total"] = time.monotonic() - started
+    return result
+
+
+def run_user(base_url, http, session_id, turns, timeout, results, lock):
+    for turn in range(turns):
+        result = run_turn(http, base_url, session_id, f"Benchmark message {turn}: how can I sleep better?", timeout)
+        with lock:
+            results.append(result)
+
+
+def summarize(results, wall_time, crashed=0):
+    ok = [r for r in results if r["status"] == 200 and not r["error"] and r["total"] is not None]
+    ttft = [r["ttft"] for r in ok if r["ttft"] is not None]
+    total = [r["total"] for r in ok]
+    summary = {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "rejected": sum(1 for r in results if r["status"] in (429, 503)),
+        "failed": sum(1 for r in results if r["error"] or (r["status"] not in (200, 429, 503))),
+        "crashed_users": crashed,
+        "replies_per_second": len(ok) / wall_time if wall_time else 0,
+        "frames_per_second": sum(r["frames"] for r in ok) / wall_time if wall_time else 0,
+        "frames_per_reply": sum(r["frames"] for r in ok) / len(ok) if ok else 0,
+    }
+    for name, values in (("ttft", ttft), ("reply_latency", total)):
+        for pct in (50, 95, 99):
+            summary[f"{name}_p{pct}"] = percentile(values, pct)
+    return summary
+
+
+def compare(summary, baseline, tolerance):
+    """Return (metric, baseline, current, change) rows and whether anything regressed"""
+    rows = []
+    regressed = False
+    for metric, current in summary.items():
+        if not metric.endswith(("_p50", "_p95", "_p99")) and metric not in HIGHER_IS_BETTER:
+            continue
+        base = baseline.get(metric)
+        if base in (None, 0) or current is None:
+            continue
+        change = (current - base) / base
+        worse = -change if metric in HIGHER_IS_BETTER else change
+        if worse > tolerance:
+            regressed = True
+        rows.append((metric, base, current, change, worse > tolerance))
+    return rows, regressed
+
+
+def print_report(summary, rows):
+    print(f"\nrequests={summary['requests']} ok={summary['succeeded']} "
+          f"rejected={summary['rejected']} failed={summary['failed']} crashed_users={summary['crashed_users']}")
+    print(f"throughput: {summary['replies_per_second']:.2f} replies/s, "
+          f"{summary['frames_per_second']:.1f} frames/s, {summary['frames_per_reply']:.1f} frames/reply")
+    for name in ("ttft", "reply_latency"):
+        values = [summary[f"{name}_p{p}"] for p in (50, 95, 99)]
+        print(f"{name:>14}: " + "  ".join(f"p{p}={v * 1000:.0f}ms" if v is not None else f"p{p}=n/a"
+                                           for p, v in zip((50, 95, 99), values)))
+    if rows:
+        print("\nvs baseline:")
+        for metric, base, current, change, bad in rows:
+            flag = "  REGRESSION" if bad else ""
+            print(f"  {metric:<22} {base:>10.4f} -> {current:>10.4f} ({change:+.1%}){flag}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--users", type=int, default=20, help="simulated users, each with its own session")
+    parser.add_argument("--turns", type=int, default=3, help="chat turns per user")
+    parser.add_argument("--concurrency", type=int, default=None, help="users active at once (default: all)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression before failing")
+    parser.add_argument("--output", help="write the summary as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    run_id = uuid.uuid4().hex[:8]
+    print(f"Creating {options.users} users...")
+    users = [create_user(options.base_url, run_id, i) for i in range(options.users)]
+
+    results = []
+    lock = threading.Lock()
+    print(f"Running {options.users} users x {options.turns} turns...")
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=options.concurrency or options.users) as pool:
+        futures = [pool.submit(run_user, options.base_url, http, session_id, options.turns, options.timeout, results, lock)
+                   for http, session_id in users]
+    wall_time = time.monotonic() - started
+
+    # A user whose thread raised stops sending turns; count it instead of losing it
+    crashed = 0
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            crashed += 1
+            print(f"User thread failed: {e!r}")
+
+    summary = summarize(results, wall_time, crashed)
+    rows, regressed = [], False
+    if os.path.exists(options.baseline) and not options.save_baseline:
+        with open(options.baseline) as f:
+            rows, regressed = compare(summary, json.load(f), options.tolerance)
+    print_report(summary, rows)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(summary, f, indent=2)
+    if options.save_baseline:
+        with open(options.baseline, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nBaseline saved to {options.baseline}")
+    elif not rows:
+        print("\nNo baseline to compare against; rerun with --save-baseline to record one")
+    return 1 if regressed or crashed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+'''Bulk import of NDJSON or CSV uploads.
+
+The upload is parsed as a stream, one record at a time. Valid records go to
+MongoDB in unordered insert_many batches, and the caller gets a per-row
+error report. Send the file as the raw request body with Content-Type
+application/x-ndjson or text/csv, or as a multipart "file" field. Uploads
+are capped at IMPORT_MAX_BYTES and each line at IMPORT_MAX_LINE_BYTES, so
+an oversized record is rejected instead of read into memory.'''
+import io
+import os
+import csv
+import json
+from datetime import datetime
+from pymongo.errors import BulkWriteError
+from werkzeug.exceptions import RequestEntityTooLarge
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "50000"))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(32 * 1024 * 1024)))  # whole upload
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(64 * 1024)))  # one line of it
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFormatError(ValueError):
+    """The upload as a whole cannot be read (unknown format, missing CSV columns, too many rows or bytes)"""
+
+
+class RowError(ValueError):
+    """One record is invalid; it is reported and skipped"""
+
+
+class _LineTooLong(ValueError):
+    pass
+
+
+def _upload(request):
+    """(binary stream, format) of the uploaded file"""
+    # Imports get their own body limit instead of the app-wide MAX_CONTENT_LENGTH
+    request.max_content_length = IMPORT_MAX_BYTES
+    upload = request.files.get("file")
+    if upload is not None:
+        stream, content_type, name = upload.stream, upload.mimetype, upload.filename or ""
+    else:
+        stream, content_type, name = request.stream, request.mimetype, ""
+    fmt = request.args.get("format")
+    if not fmt:
+        if content_type in ("application/x-ndjson", "application/jsonl") or name.endswith((".ndjson", ".jsonl")):
+            fmt = "ndjson"
+        elif content_type == "text/csv" or name.endswith(".csv"):
+            fmt = "csv"
+    if fmt not in ("ndjson", "csv"):
+        raise ImportFormatError("Upload NDJSON (application/x-ndjson) or CSV (text/csv)")
+    if isinstance(stream, io.RawIOBase):
+        stream = io.BufferedReader(stream)
+    return stream, fmt
+
+
+def _lines(stream):
+    """Decoded lines, line endings kept; a line is never read past IMPORT_MAX_LINE_BYTES"""
+    first = True
+    while True:
+        line = stream.readline(IMPORT_MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        if len(line) > IMPORT_MAX_LINE_BYTES:
+            raise _LineTooLong()
+        if first and line.startswith(b"\xef\xbb\xbf"):
+            line = line[3:]  # byte order mark some editors put at the start of UTF-8 CSVs
+        first = False
+        yield line.decode("utf-8")
+
+
+def iter_rows(request, required=()):
+    """Yield (row number, record dict or RowError) for each record of the upload"""
+    stream, fmt = _upload(request)
+    lines = _lines(stream)
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        try:
+            fieldnames = reader.fieldnames or []
+        except (UnicodeDecodeError, csv.Error, _LineTooLong, RequestEntityTooLarge) as e:
+            raise ImportFormatError(_unreadable(1, e))
+        missing = [c for c in required if c not in fieldnames]
+        if missing:
+            raise ImportFormatError(f"CSV is missing columns: {', '.join(missing)}")
+        rows = ({k: v for k, v in row.items() if k is not None and v != ""} for row in reader)
+    else:
+        rows = (line for line in lines if line.strip())
+
+    number = 0
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        except (UnicodeDecodeError, csv.Error, _LineTooLong, RequestEntityTooLarge) as e:
+            # Nothing after this point can be read reliably
+            raise ImportFormatError(_unreadable(number + 1, e))
+        number += 1
+        if number > IMPORT_MAX_ROWS:
+            raise ImportFormatError(f"Imports are limited to {IMPORT_MAX_ROWS} rows")
+        if fmt == "ndjson":
+            try:
+                row = json.loads(row)
+            except ValueError:
+                yield number, RowError("Not valid JSON")
+                continue
+            if not isinstance(row, dict):
+                yield number, RowError("Each line must be a JSON object")
+                continue
+        yield number, row
+
+
+def _unreadable(number, error):
+    if isinstance(error, UnicodeDecodeError):
+        return f"Row {number} is not valid UTF-8; save the file as UTF-8 and import it again"
+    if isinstance(error, _LineTooLong):
+        return f"Row {number} has a line longer than {IMPORT_MAX_LINE_BYTES} bytes"
+    if isinstance(error, RequestEntityTooLarge):
+        return f"Uploads are limited to {IMPORT_MAX_BYTES} bytes; reading stopped at row {number}"
+    return f"Row {number} could not be read as CSV: {error}"
+
+
+def parse_timestamp(value, field):
+    """Stored timestamps are naive local time, like datetime.now()"""
+    if value in (None, ""):
+        return datetime.now()
+    try:
+        when = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise RowError(f"{field} must be an ISO 8601 date or datetime")
+    if when.tzinfo is not None:
+        when = when.astimezone().replace(tzinfo=None)
+    return when
+
+
+def import_rows(rows, build, collection, on_inserted, batch_size=IMPORT_BATCH_SIZE):
+    """Validate rows with build(row) -> document and insert them in batches.
+
+    on_inserted(docs) is called after each batch with the documents that were
+    written, to keep rollups in step. Returns the per-row report.
+    """
+    report = {"inserted": 0, "failed": 0, "errors": []}
+
+    def fail(number, message):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": number, "error": message})
+
+    def flush(batch):
+        numbers, docs = zip(*batch)
+        failed = set()
+        try:
+            collection.insert_many(list(docs), ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                failed.add(err["index"])
+                fail(numbers[err["index"]], err.get("errmsg", "Write failed"))
+        written = [doc for i, doc in enumerate(docs) if i not in failed]
+        report["inserted"] += len(written)
+        if written:
+            on_inserted(written)
+
+    batch = []
+    rows = iter(rows)
+    while True:
+        try:
+            number, row = next(rows)
+        except StopIteration:
+            break
+        except ImportFormatError as e:
+            if not report["inserted"]:
+                # Nothing written yet: reject the whole upload
+                raise
+            # e.g. the row limit or an undecodable row: keep what was read and say where it stopped
+            report["error"] = str(e)
+            break
+        try:
+            if isinstance(row, RowError):
+                raise row
+            batch.append((number, build(row)))
+        except RowError as e:
+            fail(number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    report["errors"].sort(key=lambda e: e["row"])
+    return report
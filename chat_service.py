@@ -0,0 +1,117 @@
+import asyncio
+from db import append_message_to_session, get_recent_messages
+from context_window import build_prompt, format_message, PROMPT_MAX_MESSAGES
+from context_cache import get_context, store_context
+from ollama_chat import stream_gemma_response, astream_gemma_response, OllamaError
+from sse import SSEWriter
+from metrics import Counter
+
+cancelled_streams = Counter("chat_streams_cancelled_total", "Replies cancelled because the client went away")
+abandoned_chunks = Counter("chat_abandoned_chunks_total", "Model stream chunks received after the client went away, for cancelled replies")
+
+ERROR_EVENT = "event: error\ndata: The assistant is unavailable right now, please try again.\n\n"
+
+
+class ChatTurn:
+    """One user message and the model's reply to it.
+
+    Shared by the Flask /chat route and the ASGI one so both persist
+    messages and reuse cached model context the same way.
+    """
+
+    def __init__(self, user_id, session_id, user_msg):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.user_msg = user_msg
+        self.prompt = None
+        self.context = None
+        self.message_count = 0
+        self.final = {}  # last model frame: timings and the new context
+
+    def prepare(self):
+        """Save the user message and build what gets sent to the model; None if the user has no such session"""
+        session = append_message_to_session(self.session_id, "user", self.user_msg, self.user_id)
+        if session is None:
+            return None
+        self.message_count = session["message_count"]
+        # Continue from the model's cached state when it covers every earlier message
+        self.context = get_context(self.session_id, self.message_count - 1)
+        if self.context:
+            self.prompt = format_message({"sender": "user", "text": self.user_msg}) + "AI:"
+        else:
+            recent = get_recent_messages(self.session_id, session.get("summarized_count", 0), PROMPT_MAX_MESSAGES)
+            self.prompt = build_prompt(session, recent)
+        return self
+
+    def finish(self, reply):
+        """Save the bot reply and remember the model context for the next turn"""
+        session = append_message_to_session(self.session_id, "bot", reply, self.user_id)
+        if session is not None:  # deleted while the reply was streaming
+            store_context(self.session_id, self.final.get("context"), session["message_count"])
+
+
+def _record_cancel(buffer):
+    wasted = buffer.chunks - buffer.chunks_at_detach
+    cancelled_streams.inc()
+    abandoned_chunks.inc(wasted)
+    print(f"Chat stream {buffer.stream_id} cancelled, {wasted} chunks abandoned")
+
+def run_turn(turn, buffer):
+    """Stream the model reply for `turn` into `buffer` and persist it.
+
+    Runs independently of the client connection, so a reply that is
+    interrupted on the wire can still be replayed from the buffer. If no
+    client reattaches within the resume grace period the upstream request
+    is closed, which stops the model generating.
+    """
+    writer = SSEWriter()
+    stream = stream_gemma_response(turn.prompt, context=turn.context, final=turn.final, session_id=turn.session_id)
+    try:
+        for chunk in stream:
+            buffer.chunks += 1
+            frame = writer.write(chunk)
+            if frame:
+                buffer.append(frame)
+            if buffer.abandoned():
+                stream.close()
+                _record_cancel(buffer)
+                break
+        frame = writer.close()
+        if frame:
+            buffer.append(frame)
+        turn.finish(writer.reply)
+    except OllamaError as e:
+        print(f"Chat stream error: {e}")
+        frame = writer.close()
+        if frame:
+            buffer.append(frame)
+        buffer.append(ERROR_EVENT)
+    finally:
+        buffer.close()
+
+async def arun_turn(turn, buffer):
+    """Async twin of run_turn for the ASGI app"""
+    writer = SSEWriter()
+    stream = astream_gemma_response(turn.prompt, context=turn.context, final=turn.final, session_id=turn.session_id)
+    try:
+        async for chunk in stream:
+            buffer.chunks += 1
+            frame = writer.write(chunk)
+            if frame:
+                buffer.append(frame)
+            if buffer.abandoned():
+                await stream.aclose()
+                _record_cancel(buffer)
+                break
+        frame = writer.close()
+        if frame:
+            buffer.append(frame)
+        await asyncio.to_thread(turn.finish, writer.reply)
+    except OllamaError as e:
+        print(f"Chat stream error: {e}")
+        frame = writer.close()
+        if frame:
+            buffer.append(frame)
+        buffer.append(ERROR_EVENT)
+    finally:
+        buffer.close()
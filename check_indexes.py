@@ -0,0 +1,37 @@
+'''Checks that every hot query is served by an index, using explain().
+Run against a real MongoDB: MONGO_URI=... python check_indexes.py'''
+import sys
+from bson import ObjectId
+from dotenv import load_dotenv
+load_dotenv()
+from indexes import ensure_indexes, uses_index
+from db import users, chats, messages
+from emotion import emotions, user_options, emotion_buckets
+from journal import journal_entries
+from planner import todos, timetables
+
+user_id = ObjectId()
+
+HOT_QUERIES = {
+    "users by username": users.find({"username": "someone"}),
+    "users by email": users.find({"email": "someone@example.com"}),
+    "chat history": chats.find({"user_id": user_id, "message_count": {"$gt": 0}}).sort([("timestamp", -1), ("_id", -1)]).limit(20),
+    "session messages page": messages.find({"session_id": user_id, "seq": {"$gt": 0, "$lt": 100}}).sort("seq", -1).limit(50),
+    "emotion log": emotions.find({"user_id": user_id}).sort("timestamp", -1),
+    "emotion analytics": emotion_buckets.find({"user_id": user_id, "day": {"$gte": "2024-01-01", "$lte": "2024-01-31"}}).sort("day", 1),
+    "user options": user_options.find({"user_id": user_id}),
+    "journal entries": journal_entries.find({"user_id": user_id}).sort([("created_at", -1), ("_id", -1)]),
+    "journal entries by mood": journal_entries.find({"user_id": user_id, "mood": "happy"}).sort([("created_at", -1), ("_id", -1)]),
+    "journal search": journal_entries.find({"user_id": user_id, "$text": {"$search": "calm"}}),
+    "chat message search": messages.find({"user_id": user_id, "$text": {"$search": "calm"}}),
+    "todos": todos.find({"user_id": user_id}).sort("created_at", -1),
+    "timetable": timetables.find({"user_id": user_id}).sort("start_time", 1),
+    "timetable slot": timetables.find({"user_id": user_id, "day": "monday", "start_time": "09:00", "end_time": "10:00"}),
+}
+
+if __name__ == "__main__":
+    ensure_indexes()
+    failures = [name for name, cursor in HOT_QUERIES.items() if not uses_index(cursor)]
+    for name in HOT_QUERIES:
+        print(f"{'FAIL' if name in failures else 'ok  '}  {name}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,86 @@
+'''Checks how many MongoDB commands each hot request path sends, using the command listener in mongo.py.
+Run against a real MongoDB: MONGO_URI=... python check_round_trips.py
+It creates a throwaway user and removes everything it created when done.'''
+import sys
+from uuid import uuid4
+from dotenv import load_dotenv
+load_dotenv()
+from flask_jwt_extended import create_access_token
+from mongo import command_count
+from app import app
+from db import users, chats, messages, save_user, get_user_by_username, create_empty_chat_session, append_message_to_session, get_or_create_oauth_user
+from chat_service import ChatTurn
+from journal import journal_entries, journal_stats
+from planner import timetables
+
+name = f"roundtrips-{uuid4().hex[:12]}"
+results = []
+
+
+def check(label, expected, action):
+    """Run `action` and record how many commands it sent against `expected`"""
+    before = command_count()
+    value = action()
+    results.append((label, expected, command_count() - before))
+    return value
+
+
+def run_checks():
+    client = app.test_client()
+    save_user(name, None)
+    user_id = str(get_user_by_username(name)["_id"])
+    with app.app_context():
+        headers = {"Authorization": f"Bearer {create_access_token(identity=user_id)}"}
+
+    # /start_session: insert the session, point the user at it
+    session_id = check("POST /start_session", 2,
+                       lambda: client.post("/start_session", headers=headers).get_json()["session_id"])
+    check("create_empty_chat_session", 2, lambda: create_empty_chat_session(user_id))
+
+    # /chat preparation: append the message, then read the prompt window unless the model context is cached
+    check("append_message_to_session (first user message)", 3,
+          lambda: append_message_to_session(session_id, "user", "hello"))
+    check("append_message_to_session", 2, lambda: append_message_to_session(session_id, "bot", "hi"))
+    turn = ChatTurn(user_id, session_id, "fine")
+    check("/chat prepare (no cached context)", 3, turn.prepare)
+    turn.final = {"context": [1, 2, 3]}
+    check("/chat finish", 2, lambda: turn.finish("good to hear"))
+    check("/chat prepare (cached context)", 2, lambda: ChatTurn(user_id, session_id, "thanks").prepare())
+
+    # PUT /entries/<id>: one find_one_and_update, plus the rollup bump when the mood changes
+    entry_id = client.post("/entries", json={"title": "t", "content": "c", "mood": "happy"}, headers=headers).get_json()["_id"]
+    check("PUT /entries/<id>", 1,
+          lambda: client.put(f"/entries/{entry_id}", json={"title": "t2", "content": "c", "mood": "happy"}, headers=headers))
+    check("PUT /entries/<id> (mood changed)", 2,
+          lambda: client.put(f"/entries/{entry_id}", json={"title": "t2", "content": "c", "mood": "sad"}, headers=headers))
+
+    # POST /api/timetable: a single upsert whether the slot is new or not
+    slot = {"day": "monday", "start_time": "09:00", "end_time": "10:00", "activity": "walk"}
+    check("POST /api/timetable (new slot)", 1, lambda: client.post("/api/timetable", json=slot, headers=headers))
+    check("POST /api/timetable (existing slot)", 1,
+          lambda: client.post("/api/timetable", json={**slot, "activity": "run"}, headers=headers))
+
+    # OAuth login: look up by email; a new user also costs the username query and the upsert
+    email = f"{name}@example.com"
+    check("get_or_create_oauth_user (new user)", 3, lambda: get_or_create_oauth_user(email, "google", name=name))
+    check("get_or_create_oauth_user (returning user)", 1, lambda: get_or_create_oauth_user(email, "google", name=name))
+
+
+def clean_up():
+    user_ids = [u["_id"] for u in users.find({"username": {"$regex": f"^{name}"}}, {"_id": 1})]
+    for collection in (chats, messages, journal_entries, timetables):
+        collection.delete_many({"user_id": {"$in": user_ids}})
+    journal_stats.delete_many({"_id": {"$in": user_ids}})
+    users.delete_many({"_id": {"$in": user_ids}})
+
+
+if __name__ == "__main__":
+    try:
+        run_checks()
+    finally:
+        clean_up()
+    failures = 0
+    for label, expected, sent in results:
+        failures += sent != expected
+        print(f"{'FAIL' if sent != expected else 'ok  '}  {label}: {sent} commands (expected {expected})")
+    sys.exit(1 if failures else 0)
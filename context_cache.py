@@ -0,0 +1,56 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# Ollama returns a `context` token array at the end of each generation.
+# Feeding it back on the next turn means only the new message is evaluated.
+CONTEXT_IDLE_TTL = int(os.getenv("CHAT_CONTEXT_IDLE_TTL", "900"))  # seconds
+CONTEXT_MAX_SESSIONS = int(os.getenv("CHAT_CONTEXT_MAX_SESSIONS", "1000"))
+CONTEXT_MAX_TOKENS = int(os.getenv("CHAT_CONTEXT_MAX_TOKENS", "4096"))
+
+_entries = OrderedDict()  # session_id -> entry, least recently used first
+_lock = threading.Lock()
+
+def _evict_idle(now):
+    while _entries:
+        session_id, entry = next(iter(_entries.items()))
+        if now - entry["last_used"] < CONTEXT_IDLE_TTL and len(_entries) <= CONTEXT_MAX_SESSIONS:
+            break
+        del _entries[session_id]
+
+def get_context(session_id, message_count):
+    """Return the cached context for a session if it covers exactly `message_count` messages"""
+    now = time.monotonic()
+    with _lock:
+        _evict_idle(now)
+        entry = _entries.get(session_id)
+        if not entry:
+            return None
+        # Stale if another worker answered a turn, or the session was edited since
+        if entry["message_count"] != message_count:
+            del _entries[session_id]
+            return None
+        entry["last_used"] = now
+        _entries.move_to_end(session_id)
+        return entry["context"]
+
+def store_context(session_id, context, message_count):
+    """Remember the context returned after a reply; `message_count` includes that reply"""
+    now = time.monotonic()
+    with _lock:
+        if not context or len(context) > CONTEXT_MAX_TOKENS:
+            # Too long to keep growing: the next turn rebuilds a windowed prompt
+            _entries.pop(session_id, None)
+            return
+        _entries[session_id] = {
+            "context": context,
+            "message_count": message_count,
+            "last_used": now
+        }
+        _entries.move_to_end(session_id)
+        _evict_idle(now)
+
+def drop_context(session_id):
+    with _lock:
+        _entries.pop(session_id, None)
@@ -0,0 +1,79 @@
+import os
+import re
+from db import update_session_summary
+
+SYSTEM_PROMPT = "You are a kind and empathetic mental health bot, all you need to do is reply to the user's message kindly.\n"
+
+# Most recent messages loaded when building a prompt; older unsummarized ones are skipped
+PROMPT_MAX_MESSAGES = int(os.getenv("CHAT_PROMPT_MAX_MESSAGES", "100"))
+
+# Prompt budget, in (estimated) model tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKENS", "1500"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+SUMMARY_POINT_CHARS = 160
+CHARS_PER_TOKEN = 4  # rough average for English text
+
+_sentence_end = re.compile(r"(?<=[.!?])\s")
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def format_message(msg):
+    speaker = "User" if msg["sender"] == "user" else "AI"
+    return f"{speaker}: {msg['text']}\n"
+
+def summarize_message(msg):
+    """One short line describing a message that dropped out of the window"""
+    text = " ".join(msg["text"].split())
+    first_sentence = _sentence_end.split(text, 1)[0]
+    if len(first_sentence) > SUMMARY_POINT_CHARS:
+        first_sentence = first_sentence[:SUMMARY_POINT_CHARS].rstrip() + "..."
+    speaker = "User" if msg["sender"] == "user" else "AI"
+    return f"- {speaker} said: {first_sentence}"
+
+def fold_into_summary(summary, messages):
+    """Append the evicted messages to the running summary, dropping the oldest points once it is over budget"""
+    points = summary.split("\n") if summary else []
+    points.extend(summarize_message(m) for m in messages if m.get("text"))
+    max_chars = SUMMARY_TOKEN_BUDGET * CHARS_PER_TOKEN
+    total = sum(len(p) + 1 for p in points)
+    while len(points) > 1 and total > max_chars:
+        total -= len(points.pop(0)) + 1
+    return "\n".join(points)
+
+def build_prompt(session, messages):
+    """Build the prompt from the newest turns that fit the token budget.
+
+    `messages` are the session's not-yet-summarized messages, oldest first
+    (see get_recent_messages). Turns that no longer fit are folded into a
+    running summary cached on the session document, so each message is
+    summarized at most once.
+    """
+    summary = session.get("summary", "")
+
+    budget = CONTEXT_TOKEN_BUDGET - estimate_tokens(SYSTEM_PROMPT) - SUMMARY_TOKEN_BUDGET
+    window = []
+    used = 0
+    start = len(messages)
+    while start > 0:
+        line = format_message(messages[start - 1])
+        cost = estimate_tokens(line)
+        # Always keep the newest message, even if it alone is over budget
+        if window and used + cost > budget:
+            break
+        window.append(line)
+        used += cost
+        start -= 1
+
+    if start > 0:
+        summary = fold_into_summary(summary, messages[:start])
+        update_session_summary(session["_id"], summary, messages[start - 1]["seq"])
+
+    parts = [SYSTEM_PROMPT]
+    if summary:
+        parts.append("Summary of the earlier conversation:\n")
+        parts.append(summary)
+        parts.append("\n")
+    parts.extend(reversed(window))
+    parts.append("AI:")
+    return "".join(parts)
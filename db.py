@@ -1,13 +1,35 @@
-from pymongo import MongoClient
+import re
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
 from datetime import datetime
-import os
-client = MongoClient(os.environ.get("MONGO_URI"))
-db = client["mydatabase"]
+from pymongo import IndexModel, ASCENDING, DESCENDING, TEXT
+from indexes import register_indexes
+from pagination import after_cursor
+from mongo import database
+db = database("mydatabase")  # connects lazily, once per process (see mongo.py)
 
 # Collections
 users = db["users"]
 chats = db["chat_sessions"]
+messages = db["chat_messages"]  # one document per message, numbered by seq within a session
+
+register_indexes(users,
+    IndexModel([("username", ASCENDING)], unique=True),
+    # OAuth users have an email, password users may not
+    IndexModel([("email", ASCENDING)], unique=True, partialFilterExpression={"email": {"$type": "string"}})
+)
+register_indexes(chats,
+    IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)]),
+    # /history: non-empty sessions, newest first, keyset-paged on (timestamp, _id)
+    IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+               partialFilterExpression={"message_count": {"$gt": 0}})
+)
+register_indexes(messages,
+    IndexModel([("session_id", ASCENDING), ("seq", ASCENDING)], unique=True),
+    # /search: every $text query is scoped to one user
+    IndexModel([("user_id", ASCENDING), ("text", TEXT)], name="user_text")
+)
 
 # 🧾 Save a new user
 def save_user(username, password, email=None, provider=None, name=None, picture=None):
@@ -35,6 +57,18 @@ def get_user_by_username(username):
 def get_user_by_email(email):
     return users.find_one({"email": email})
 
+# 🔤 First free username of the form base, base1, base2, ... (one query for all taken ones)
+def _free_username(base_username):
+    taken = {u["username"] for u in users.find(
+        {"username": {"$regex": f"^{re.escape(base_username)}\\d*$"}}, {"_id": 0, "username": 1}
+    )}
+    if base_username not in taken:
+        return base_username
+    counter = 1
+    while f"{base_username}{counter}" in taken:
+        counter += 1
+    return f"{base_username}{counter}"
+
 # 🔍 Get or create OAuth user
 def get_or_create_oauth_user(email, provider, name=None, picture=None):
     # Check if user exists
@@ -44,63 +78,137 @@ def get_or_create_oauth_user(email, provider, name=None, picture=None):
         return user
     
     # Create new user with email as username if no name provided
-    username = name or email.split('@')[0]
-    # Ensure unique username
-    base_username = username
-    counter = 1
-    while get_user_by_username(username):
-        username = f"{base_username}{counter}"
-        counter += 1
-    
-    # Create user without password for OAuth
-    user_data = {
-        "username": username,
-        "email": email,
-        "provider": provider,
-        "password": None  # OAuth users don't have passwords
-    }
-    
-    if name:
-        user_data["name"] = name
-    if picture:
-        user_data["picture"] = picture
-        
-    result = users.insert_one(user_data)
-    return users.find_one({"_id": result.inserted_id})
+    base_username = name or email.split('@')[0]
+    while True:
+        # Create user without password for OAuth
+        user_data = {
+            "username": _free_username(base_username),
+            "email": email,
+            "provider": provider,
+            "password": None  # OAuth users don't have passwords
+        }
+        if name:
+            user_data["name"] = name
+        if picture:
+            user_data["picture"] = picture
+        try:
+            # Upsert on email: if a concurrent login created this user first, that user is returned
+            return users.find_one_and_update(
+                {"email": email},
+                {"$setOnInsert": user_data},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Someone took the username in the meantime; pick the next free one
+            continue
 
-# 🆕 Create a new empty chat session for a user, set as active and deactivate others
+# 🆕 Create a new empty chat session for a user and make it their active one
+# The active session is a pointer on the user (active_session_id), so starting a chat
+# costs the same however many sessions the user already has
 def create_empty_chat_session(user_id):
-    chats.update_many({"user_id": ObjectId(user_id)}, {"$set": {"active": False}})
     session = {
         "user_id": ObjectId(user_id),
         "timestamp": datetime.now(),
-        "messages": [],
-        "active": True
+        "message_count": 0
     }
     result = chats.insert_one(session)
+    users.update_one({"_id": ObjectId(user_id)}, {"$set": {"active_session_id": result.inserted_id}})
     return str(result.inserted_id)
 
+# 📌 Id of the user's active session, or None
+# Users who last started a session before the pointer existed only have chats.active: true;
+# that session is looked up once and saved as their pointer (None if there is none)
+def get_active_session_id(user_id):
+    user = users.find_one({"_id": ObjectId(user_id)}, {"active_session_id": 1})
+    if not user:
+        return None
+    if "active_session_id" in user:
+        return user["active_session_id"]
+    legacy = chats.find_one({"user_id": ObjectId(user_id), "active": True}, {"_id": 1}, sort=[("timestamp", -1)])
+    session_id = legacy["_id"] if legacy else None
+    # Only fill it in if a new session hasn't set it meanwhile
+    users.update_one({"_id": ObjectId(user_id), "active_session_id": {"$exists": False}},
+                     {"$set": {"active_session_id": session_id}})
+    return session_id
+
+HISTORY_PREVIEW_CHARS = 200  # length of the first user message kept on the session for /history
+
 # ➕ Append a message to a specific session
-def append_message_to_session(session_id, sender, text):
+# Returns the updated session (without messages): its message_count is the new message's seq,
+# and it carries the prompt summary, so callers do not need to read the session again.
+# Returns None if there is no such session (or it belongs to someone other than user_id).
+# Also keeps the session's /history summary fields (last_message_time, first_user_message) up to date
+def append_message_to_session(session_id, sender, text, user_id=None):
+    if not ObjectId.is_valid(session_id):
+        return None
+    owner = {"user_id": ObjectId(user_id)} if user_id else {}
+    now = datetime.now()
+    session = chats.find_one_and_update(
+        # Sessions that still embed their messages would restart seq at 1 under the migrated ones
+        {"_id": ObjectId(session_id), "messages": {"$exists": False}, **owner},
+        {"$inc": {"message_count": 1}, "$set": {"last_message_time": now}},
+        projection={"user_id": 1, "message_count": 1, "first_user_message": 1, "summary": 1, "summarized_count": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if session is None:
+        if chats.count_documents({"_id": ObjectId(session_id), "messages": {"$exists": True}, **owner}, limit=1):
+            raise RuntimeError(f"Chat session {session_id} has not been migrated; run migrate_messages.py")
+        return None
+    seq = session["message_count"]
+    messages.insert_one({
+        "session_id": ObjectId(session_id),
+        "seq": seq,
+        "user_id": session["user_id"],
+        "sender": sender,
+        "text": text,
+        "timestamp": now
+    })
+    if sender == "user" and "first_user_message" not in session:
+        # Only ever runs once per session; the filter keeps it from overwriting a concurrent first message
+        chats.update_one(
+            {"_id": ObjectId(session_id), "first_user_message": {"$exists": False}},
+            {"$set": {"first_user_message": text[:HISTORY_PREVIEW_CHARS]}}
+        )
+    return session
+
+# 📄 Page through a session's messages in seq order
+def get_session_messages(session_id, after_seq=0, before_seq=None, limit=50, newest_first=False):
+    query = {"session_id": ObjectId(session_id), "seq": {"$gt": after_seq}}
+    if before_seq is not None:
+        query["seq"]["$lt"] = before_seq
+    cursor = messages.find(query, {"_id": 0, "session_id": 0, "user_id": 0}).sort("seq", -1 if newest_first else 1).limit(limit)
+    return list(cursor)
+
+# 🕑 The newest `limit` messages after `after_seq`, oldest first
+def get_recent_messages(session_id, after_seq=0, limit=50):
+    return get_session_messages(session_id, after_seq=after_seq, limit=limit, newest_first=True)[::-1]
+
+# 📝 Cache the running summary of turns that fell out of the prompt window
+def update_session_summary(session_id, summary, summarized_count):
     chats.update_one(
         {"_id": ObjectId(session_id)},
-        {"$push": {"messages": {"sender": sender, "text": text, "timestamp": datetime.now()}}}
+        {"$set": {"summary": summary, "summarized_count": summarized_count}}
     )
 
-# 📜 Get all chat sessions for a user
-def get_user_sessions(user_id):
+# 📜 One page of a user's non-empty chat sessions, newest first, without their messages
+def get_user_sessions(user_id, cursor=None, limit=20):
+    query = {"user_id": ObjectId(user_id), "message_count": {"$gt": 0}}
+    if cursor:
+        query.update(after_cursor("timestamp", cursor))
     return list(chats.find(
-        {"user_id": ObjectId(user_id)},
-        {"_id": 1, "timestamp": 1, "messages": 1, "active": 1}
-    ))
+        query,
+        {"_id": 1, "timestamp": 1, "message_count": 1, "first_user_message": 1, "last_message_time": 1}
+    ).sort([("timestamp", DESCENDING), ("_id", DESCENDING)]).limit(limit))
 
-# Get a single session by ID (for loading a session)
+# Get a single session by ID (for loading a session); messages are fetched separately
 def get_session_by_id(session_id):
     return chats.find_one({"_id": ObjectId(session_id)})
 
 # Get the user's active session
 def get_active_session(user_id):
-    return chats.find_one({"user_id": ObjectId(user_id), "active": True})
+    session_id = get_active_session_id(user_id)
+    return chats.find_one({"_id": session_id}) if session_id else None
 
 # (Optional) For admin/testing: get all chats
 def get_all_chats():
@@ -1,13 +1,127 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from bson import ObjectId
-from datetime import datetime
-from db import client
+from datetime import datetime, timedelta
+from mongo import database
+from pymongo import IndexModel, ASCENDING, DESCENDING, UpdateOne, ReplaceOne
+from indexes import register_indexes
+from json_stream import stream_documents
+from json_provider import public
+from bulk_import import iter_rows, import_rows, parse_timestamp, ImportFormatError, RowError
 
 bp = Blueprint('emotion', __name__)
-db = client["mental_health_db"]
+db = database("mental_health_db")
 emotions = db["emotions"]
 user_options = db["user_options"]  # Store custom options for each user
+# One document per user per day, kept current by log_emotion/delete_emotion/import:
+# {user_id, day: "YYYY-MM-DD", total, intensity_sum, intensity_count, moods: {mood: n},
+#  locations/companies/activities: {value: {count, intensity_sum, intensity_count}}}
+emotion_buckets = db["emotion_buckets"]
+# {_id: user_id, rebuilt_at}: set once rebuild_buckets has counted every earlier log. Without it a
+# user's buckets only hold logs made since buckets were introduced, so they are rebuilt before use
+emotion_bucket_state = db["emotion_bucket_state"]
+
+register_indexes(emotions, IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)]))
+register_indexes(user_options, IndexModel([("user_id", ASCENDING)], unique=True))
+register_indexes(emotion_buckets, IndexModel([("user_id", ASCENDING), ("day", ASCENDING)], unique=True))
+
+BREAKDOWNS = {'location': 'locations', 'company': 'companies', 'activity': 'activities'}
+MAX_RANGE_DAYS = 366
+DEFAULT_RANGE_DAYS = 30
+
+def _key(value):
+    # Moods and options are user input and become field names: keep them valid in a dotted path
+    return str(value).replace(".", "\uff0e").replace("$", "\uff04")
+
+def _unkey(key):
+    return key.replace("\uff0e", ".").replace("\uff04", "$")
+
+def _bucket_inc(log, delta):
+    """$inc for the day bucket of one mood log (delta -1 when it is deleted)"""
+    intensity = log.get('intensity')
+    scored = intensity is not None
+    inc = {'total': delta, f"moods.{_key(log['mood'])}": delta}
+    if scored:
+        inc['intensity_sum'] = delta * intensity
+        inc['intensity_count'] = delta
+    for field, plural in BREAKDOWNS.items():
+        value = log.get(field)
+        if not value:
+            continue
+        path = f"{plural}.{_key(value)}"
+        inc[f"{path}.count"] = delta
+        if scored:
+            inc[f"{path}.intensity_sum"] = delta * intensity
+            inc[f"{path}.intensity_count"] = delta
+    return inc
+
+def _bump_bucket(user_id, log, delta):
+    emotion_buckets.update_one(
+        {'user_id': ObjectId(user_id), 'day': f"{log['timestamp']:%Y-%m-%d}"},
+        {'$inc': _bucket_inc(log, delta)},
+        # Once rebuilt, a missing bucket on delete can only be drift: don't create a negative one
+        upsert=delta > 0
+    )
+
+def _day_incs(logs):
+    """{day: $inc} adding up many mood logs"""
+    days = {}
+    for log in logs:
+        day = days.setdefault(f"{log['timestamp']:%Y-%m-%d}", {})
+        for path, n in _bucket_inc(log, 1).items():
+            day[path] = day.get(path, 0) + n
+    return days
+
+def _bump_buckets(user_id, logs):
+    """Add many mood logs to their day buckets with one $inc per day"""
+    days = _day_incs(logs)
+    if days:
+        emotion_buckets.bulk_write([
+            UpdateOne({'user_id': ObjectId(user_id), 'day': day}, {'$inc': inc}, upsert=True)
+            for day, inc in days.items()
+        ], ordered=False)
+    return len(days)
+
+def _nest(inc):
+    """Bucket fields from dotted $inc paths, for writing a whole bucket at once"""
+    doc = {}
+    for path, n in inc.items():
+        *parents, leaf = path.split('.')
+        node = doc
+        for part in parents:
+            node = node.setdefault(part, {})
+        node[leaf] = n
+    return doc
+
+def rebuild_buckets(user_id):
+    """Recompute all of a user's day buckets from their mood logs, repairing any drift.
+
+    The new buckets are computed first and each one replaces the old bucket for its day, so
+    a concurrent log_emotion never lands in an emptied bucket and gets counted twice. Only a
+    log written while its day is being replaced can still be missed or counted twice, until
+    the next rebuild.
+    """
+    fields = {'timestamp': 1, 'mood': 1, 'intensity': 1, 'location': 1, 'company': 1, 'activity': 1}
+    days = _day_incs(emotions.find({'user_id': ObjectId(user_id)}, fields))
+    if days:
+        emotion_buckets.bulk_write([
+            ReplaceOne({'user_id': ObjectId(user_id), 'day': day},
+                       {'user_id': ObjectId(user_id), 'day': day, **_nest(inc)}, upsert=True)
+            for day, inc in days.items()
+        ], ordered=False)
+    emotion_buckets.delete_many({'user_id': ObjectId(user_id), 'day': {'$nin': list(days)}})
+    emotion_bucket_state.update_one({'_id': ObjectId(user_id)}, {'$set': {'rebuilt_at': datetime.now()}}, upsert=True)
+    return len(days)
+
+def _ensure_buckets(user_id):
+    """Rebuild a user's buckets if they have never been; True if that happened"""
+    if emotion_bucket_state.find_one({'_id': ObjectId(user_id)}, {'_id': 1}):
+        return False
+    rebuild_buckets(user_id)
+    return True
+
+def _average(total, count):
+    return round(total / count, 2) if count else None
 
 # POST /api/emotion - log a mood
 @bp.route('/api/emotion', methods=['POST'])
@@ -25,7 +139,7 @@ def log_emotion():
     if not mood:
         return jsonify({'error': 'Mood is required'}), 400
     
-    emotions.insert_one({
+    log = {
         'user_id': ObjectId(user_id),
         'timestamp': datetime.now(),
         'mood': mood,
@@ -34,21 +148,125 @@ def log_emotion():
         'location': location,
         'company': company,
         'activity': activity
-    })
+    }
+    emotions.insert_one(log)
+    _bump_bucket(user_id, log, 1)
     return jsonify({'message': 'Mood logged successfully'})
 
-# GET /api/emotion - get all moods for user
+def _import_log(user_id, row):
+    mood = row.get('mood')
+    if not mood:
+        raise RowError('mood is required')
+    intensity = row.get('intensity')
+    if intensity not in (None, ''):
+        try:
+            intensity = int(intensity)
+        except (TypeError, ValueError):
+            raise RowError('intensity must be a whole number')
+    else:
+        intensity = None
+    return {
+        'user_id': ObjectId(user_id),
+        'timestamp': parse_timestamp(row.get('timestamp'), 'timestamp'),
+        'mood': str(mood),
+        'note': str(row.get('note', '')),
+        'intensity': intensity,
+        'location': str(row.get('location', '')),
+        'company': str(row.get('company', '')),
+        'activity': str(row.get('activity', ''))
+    }
+
+# POST /api/emotion/import - bulk import mood logs from an NDJSON or CSV upload
+# Columns/keys: mood (required), timestamp (ISO 8601), intensity, note, location, company, activity
+@bp.route('/api/emotion/import', methods=['POST'])
+@jwt_required()
+def import_emotions():
+    user_id = get_jwt_identity()
+    try:
+        report = import_rows(
+            iter_rows(request, required=('mood',)),
+            lambda row: _import_log(user_id, row),
+            emotions,
+            lambda logs: _bump_buckets(user_id, logs)
+        )
+    except ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(report)
+
+# GET /api/emotion - get all moods for user (streamed; ?format=ndjson for one log per line)
 @bp.route('/api/emotion', methods=['GET'])
 @jwt_required()
 def get_emotions():
     user_id = get_jwt_identity()
-    logs = list(emotions.find({'user_id': ObjectId(user_id)}).sort('timestamp', -1))
-    for log in logs:
-        log['id'] = str(log['_id'])
-        log['timestamp'] = log['timestamp'].isoformat()
-        del log['_id']
-        del log['user_id']
-    return jsonify(logs)
+    logs = emotions.find({'user_id': ObjectId(user_id)}, {'user_id': 0}).sort('timestamp', -1)
+    return stream_documents(logs, public)
+
+# GET /api/emotion/analytics?from=YYYY-MM-DD&to=YYYY-MM-DD&granularity=day|week
+# Mood distribution, average intensity and location/company/activity breakdowns for a date range,
+# summed from day buckets so the cost depends on the range, not on how long the user has been logging
+@bp.route('/api/emotion/analytics', methods=['GET'])
+@jwt_required()
+def emotion_analytics():
+    user_id = get_jwt_identity()
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('day', 'week'):
+        return jsonify({'error': 'granularity must be day or week'}), 400
+    try:
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d') if 'to' in request.args else datetime.now()
+        start = datetime.strptime(request.args['from'], '%Y-%m-%d') if 'from' in request.args \
+            else end - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    except ValueError:
+        return jsonify({'error': 'from and to must be YYYY-MM-DD'}), 400
+    start, end = start.date(), end.date()
+    if start > end or (end - start).days >= MAX_RANGE_DAYS:
+        return jsonify({'error': f'Date range must be between 1 and {MAX_RANGE_DAYS} days'}), 400
+    _ensure_buckets(user_id)
+
+    days = emotion_buckets.find(
+        {'user_id': ObjectId(user_id), 'day': {'$gte': start.isoformat(), '$lte': end.isoformat()}},
+        {'_id': 0, 'user_id': 0}
+    ).sort('day', 1)
+
+    totals = {'total': 0, 'intensity_sum': 0, 'intensity_count': 0, 'moods': {}}
+    breakdowns = {plural: {} for plural in BREAKDOWNS.values()}
+    periods = {}
+    for bucket in days:
+        day = datetime.strptime(bucket['day'], '%Y-%m-%d').date()
+        period_start = day - timedelta(days=day.weekday()) if granularity == 'week' else day
+        period = periods.setdefault(period_start, {'total': 0, 'intensity_sum': 0, 'intensity_count': 0, 'moods': {}})
+        for acc in (totals, period):
+            for field in ('total', 'intensity_sum', 'intensity_count'):
+                acc[field] += bucket.get(field, 0)
+            for mood, n in bucket.get('moods', {}).items():
+                acc['moods'][mood] = acc['moods'].get(mood, 0) + n
+        for plural, acc in breakdowns.items():
+            for value, counts in bucket.get(plural, {}).items():
+                entry = acc.setdefault(value, {'count': 0, 'intensity_sum': 0, 'intensity_count': 0})
+                for field in entry:
+                    entry[field] += counts.get(field, 0)
+
+    def moods(counts):
+        return {_unkey(m): n for m, n in sorted(counts.items(), key=lambda kv: -kv[1]) if n > 0}
+
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'granularity': granularity,
+        'total': totals['total'],
+        'average_intensity': _average(totals['intensity_sum'], totals['intensity_count']),
+        'moods': moods(totals['moods']),
+        'buckets': [{
+            'start': period_start.isoformat(),
+            'total': p['total'],
+            'average_intensity': _average(p['intensity_sum'], p['intensity_count']),
+            'moods': moods(p['moods'])
+        } for period_start, p in sorted(periods.items()) if p['total'] > 0],
+        **{f'by_{field}': sorted((
+            {'value': _unkey(value), 'count': e['count'],
+             'average_intensity': _average(e['intensity_sum'], e['intensity_count'])}
+            for value, e in breakdowns[plural].items() if e['count'] > 0
+        ), key=lambda e: -e['count']) for field, plural in BREAKDOWNS.items()}
+    })
 
 # GET /api/user-options - get user's custom options
 @bp.route('/api/user-options', methods=['GET'])
@@ -106,5 +324,8 @@ def add_user_option():
 @jwt_required()
 def delete_emotion(log_id):
     user_id = get_jwt_identity()
-    emotions.delete_one({'_id': ObjectId(log_id), 'user_id': ObjectId(user_id)})
+    deleted = emotions.find_one_and_delete({'_id': ObjectId(log_id), 'user_id': ObjectId(user_id)})
+    # A first rebuild already leaves the deleted log out; otherwise every log is in a bucket
+    if deleted and not _ensure_buckets(user_id):
+        _bump_bucket(user_id, deleted, -1)
     return jsonify({'message': 'Deleted'})
@@ -0,0 +1,24 @@
+from pymongo.errors import PyMongoError
+
+# Indexes declared next to the collections they belong to (db.py and each
+# blueprint) and created once at startup by ensure_indexes()
+_registry = []
+
+def register_indexes(collection, *indexes):
+    """Declare IndexModels for a collection"""
+    _registry.append((collection, list(indexes)))
+
+def ensure_indexes():
+    """Create every registered index. Safe to run on each startup: existing indexes are left as they are"""
+    for collection, models in _registry:
+        try:
+            collection.create_indexes(models)
+        except PyMongoError as e:
+            # e.g. duplicate usernames already stored; the app still works, just slower
+            print(f"[Indexes] Could not create indexes on {collection.full_name}: {e}")
+
+def uses_index(cursor):
+    """True if the query plan for a cursor avoids a full collection scan"""
+    plan = cursor.explain()["queryPlanner"]["winningPlan"]
+    return "COLLSCAN" not in str(plan)
+
@@ -1,14 +1,112 @@
+import os
+import time
+import threading
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from bson import ObjectId
 from datetime import datetime, timedelta
 from db import db
+from pymongo import IndexModel, ASCENDING, DESCENDING, TEXT, ReturnDocument
+from indexes import register_indexes
+from pagination import after_cursor, page_size, next_cursor, InvalidCursor
+from text_search import literal_query
+from bulk_import import iter_rows, import_rows, parse_timestamp, ImportFormatError, RowError
 
 bp = Blueprint('journal', __name__)
 
 # Collection for journal entries
 journal_entries = db["journal_entries"]
 
+register_indexes(journal_entries,
+    # _id breaks created_at ties for keyset pagination
+    IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("user_id", ASCENDING), ("mood", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+    # Search (?search= and /search); titles count for more than body text
+    IndexModel([("user_id", ASCENDING), ("title", TEXT), ("content", TEXT)],
+               name="user_title_content_text", weights={"title": 3, "content": 1})
+)
+
+# Per-user rollups behind /entries/stats, one document per user keyed by user_id:
+# {total, moods: {mood: n}, months: {"YYYY-MM": n}, days: {"YYYY-MM-DD": n}}
+# Kept current with $inc by create/update/delete; rebuild_stats() recomputes one from the entries
+# and sets rebuilt_at. A rollup without rebuilt_at only holds deltas and is rebuilt before it is read.
+journal_stats = db["journal_stats"]
+
+def _mood_key(mood):
+    # Moods are user input and become field names: keep them valid in a dotted path
+    return (mood or "_none").replace(".", "\uff0e").replace("$", "\uff04")
+
+def _mood_from_key(key):
+    return "" if key == "_none" else key.replace("\uff0e", ".").replace("\uff04", "$")
+
+def _rollup_inc(mood, created_at, delta):
+    return {
+        "total": delta,
+        f"moods.{_mood_key(mood)}": delta,
+        f"months.{created_at:%Y-%m}": delta,
+        f"days.{created_at:%Y-%m-%d}": delta
+    }
+
+def bump_stats(user_id, inc):
+    journal_stats.update_one({"_id": ObjectId(user_id)}, {"$inc": inc}, upsert=True)
+
+def rebuild_stats(user_id):
+    """Recompute a user's rollup from their entries, repairing any drift"""
+    match = {"$match": {"user_id": ObjectId(user_id)}}
+    def group(key):
+        return list(journal_entries.aggregate([match, {"$group": {"_id": key, "count": {"$sum": 1}}}]))
+    rollup = {
+        "total": journal_entries.count_documents({"user_id": ObjectId(user_id)}),
+        "moods": {_mood_key(g["_id"]): g["count"] for g in group("$mood")},
+        "months": {g["_id"]: g["count"] for g in group({"$dateToString": {"format": "%Y-%m", "date": "$created_at"}})},
+        "days": {g["_id"]: g["count"] for g in group({"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}})},
+        "rebuilt_at": datetime.now()
+    }
+    journal_stats.replace_one({"_id": ObjectId(user_id)}, rollup, upsert=True)
+    return rollup
+
+def get_rollup(user_id):
+    rollup = journal_stats.find_one({"_id": ObjectId(user_id)})
+    if rollup is None or "rebuilt_at" not in rollup:
+        # Never rebuilt: any $inc so far only counted entries written since rollups were introduced
+        rollup = rebuild_stats(user_id)
+    return rollup
+
+# Search totals can't come from the rollup, so they are cached briefly per (user, filter)
+# instead of counted on every page. The cache is per process (see count_entries)
+COUNT_CACHE_TTL = float(os.getenv("JOURNAL_COUNT_CACHE_TTL", "60"))
+COUNT_CACHE_MAX = 10000
+_count_cache = {}  # (user_id, mood, search) -> (expires_at, total)
+_count_lock = threading.Lock()
+
+def count_entries(user_id, mood_filter, search_query, filter_query):
+    """Total of a listing. Unfiltered and mood-filtered totals are read from the rollup, which
+    every write keeps current, so all workers agree. Search totals are cached in this process:
+    another worker can report one that is up to COUNT_CACHE_TTL seconds stale after a write."""
+    if not search_query:
+        rollup = get_rollup(user_id)
+        if mood_filter:
+            return rollup.get("moods", {}).get(_mood_key(mood_filter), 0)
+        return rollup.get("total", 0)
+    key = (user_id, mood_filter, search_query)
+    now = time.monotonic()
+    with _count_lock:
+        cached = _count_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    total = journal_entries.count_documents(filter_query)
+    with _count_lock:
+        if len(_count_cache) >= COUNT_CACHE_MAX:
+            _count_cache.clear()
+        _count_cache[key] = (now + COUNT_CACHE_TTL, total)
+    return total
+
+def invalidate_counts(user_id):
+    """Drop this process's cached search totals for a user after one of their entries changes"""
+    with _count_lock:
+        for key in [k for k in _count_cache if k[0] == user_id]:
+            del _count_cache[key]
+
 @bp.route("/entries", methods=["POST"])
 @jwt_required()
 def create_entry():
@@ -26,21 +124,77 @@ def create_entry():
         "updated_at": datetime.now()
     }
     
-    result = journal_entries.insert_one(entry)
-    entry["_id"] = str(result.inserted_id)
-    entry["user_id"] = str(entry["user_id"])
-    entry["created_at"] = entry["created_at"].isoformat()
-    entry["updated_at"] = entry["updated_at"].isoformat()
+    journal_entries.insert_one(entry)
+    invalidate_counts(user_id)
+    bump_stats(user_id, _rollup_inc(entry["mood"], entry["created_at"], 1))
     
     return jsonify(entry), 201
 
+def _import_entry(user_id, row):
+    title = str(row.get("title", ""))
+    content = str(row.get("content", ""))
+    if not (title or content):
+        raise RowError("title or content is required")
+    tags = row.get("tags", [])
+    if isinstance(tags, str):
+        # CSV has no lists: tags are separated by semicolons
+        tags = [t.strip() for t in tags.split(";") if t.strip()]
+    elif not isinstance(tags, list):
+        raise RowError("tags must be a list")
+    created_at = parse_timestamp(row.get("created_at"), "created_at")
+    return {
+        "user_id": ObjectId(user_id),
+        "title": title,
+        "content": content,
+        "mood": str(row.get("mood", "")),
+        "tags": tags,
+        "created_at": created_at,
+        "updated_at": created_at
+    }
+
+def _imported_entries(user_id, entries):
+    inc = {}
+    for entry in entries:
+        for path, n in _rollup_inc(entry["mood"], entry["created_at"], 1).items():
+            inc[path] = inc.get(path, 0) + n
+    bump_stats(user_id, inc)
+    invalidate_counts(user_id)
+
+@bp.route("/entries/import", methods=["POST"])
+@jwt_required()
+def import_entries():
+    """Bulk import journal entries from an NDJSON or CSV upload.
+
+    Keys/columns: title, content (one of them required), mood, tags
+    (a list, or semicolon-separated in CSV) and created_at (ISO 8601).
+    """
+    user_id = get_jwt_identity()
+    try:
+        report = import_rows(
+            iter_rows(request),
+            lambda row: _import_entry(user_id, row),
+            journal_entries,
+            lambda entries: _imported_entries(user_id, entries)
+        )
+    except ImportFormatError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(report)
+
 @bp.route("/entries", methods=["GET"])
 @jwt_required()
 def get_entries():
-    """Get all journal entries for the current user"""
+    """Get journal entries for the current user, newest first.
+
+    Pass ?cursor= (empty for the first page, then next_cursor) to page by
+    cursor; add ?include_total=1 to also get the total. Without cursor the
+    old page/limit response is returned. With ?search= the total is cached
+    per worker and can lag a create or delete by JOURNAL_COUNT_CACHE_TTL
+    seconds; other totals are always current.
+    """
     user_id = get_jwt_identity()
     
     # Get query parameters for filtering
+    cursor = request.args.get("cursor")
     page = int(request.args.get("page", 1))
     limit = int(request.args.get("limit", 10))
     mood_filter = request.args.get("mood", "")
@@ -51,31 +205,43 @@ def get_entries():
     if mood_filter:
         filter_query["mood"] = mood_filter
     if search_query:
-        filter_query["$or"] = [
-            {"title": {"$regex": search_query, "$options": "i"}},
-            {"content": {"$regex": search_query, "$options": "i"}}
-        ]
+        # Matches entries containing any of the words, using the text index; input is never a regex
+        terms = literal_query(search_query)
+        if not terms:
+            return jsonify({"error": "Search must contain at least one word"}), 400
+        filter_query["$text"] = {"$search": terms}
+    
+    if cursor is not None:
+        limit = page_size(limit)
+        query = dict(filter_query)
+        if cursor:
+            try:
+                query.update(after_cursor("created_at", cursor))
+            except InvalidCursor as e:
+                return jsonify({"error": str(e)}), 400
+        entries = list(journal_entries.find(query)
+                      .sort([("created_at", -1), ("_id", -1)])
+                      .limit(limit))
+        response = {
+            "next_cursor": next_cursor(entries, "created_at", limit),
+            "entries": entries,
+            "limit": limit
+        }
+        if request.args.get("include_total") in ("1", "true"):
+            response["total"] = count_entries(user_id, mood_filter, search_query, filter_query)
+        return jsonify(response)
     
     # Get total count for pagination
-    total = journal_entries.count_documents(filter_query)
+    total = count_entries(user_id, mood_filter, search_query, filter_query)
     
     # Get entries with pagination
     entries = list(journal_entries.find(filter_query)
-                  .sort("created_at", -1)
+                  .sort([("created_at", -1), ("_id", -1)])
                   .skip((page - 1) * limit)
                   .limit(limit))
     
-    # Format entries
-    formatted_entries = []
-    for entry in entries:
-        entry["_id"] = str(entry["_id"])
-        entry["user_id"] = str(entry["user_id"])
-        entry["created_at"] = entry["created_at"].isoformat()
-        entry["updated_at"] = entry["updated_at"].isoformat()
-        formatted_entries.append(entry)
-    
     return jsonify({
-        "entries": formatted_entries,
+        "entries": entries,
         "total": total,
         "page": page,
         "limit": limit,
@@ -96,11 +262,6 @@ def get_entry(entry_id):
     if not entry:
         return jsonify({"error": "Entry not found"}), 404
     
-    entry["_id"] = str(entry["_id"])
-    entry["user_id"] = str(entry["user_id"])
-    entry["created_at"] = entry["created_at"].isoformat()
-    entry["updated_at"] = entry["updated_at"].isoformat()
-    
     return jsonify(entry)
 
 @bp.route("/entries/<entry_id>", methods=["PUT"])
@@ -118,21 +279,23 @@ def update_entry(entry_id):
         "updated_at": datetime.now()
     }
     
-    result = journal_entries.update_one(
+    previous = journal_entries.find_one_and_update(
         {"_id": ObjectId(entry_id), "user_id": ObjectId(user_id)},
-        {"$set": update_data}
+        {"$set": update_data},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.matched_count == 0:
+    if previous is None:
         return jsonify({"error": "Entry not found"}), 404
+    invalidate_counts(user_id)  # mood/title/content edits can change filtered totals
+    if previous.get("mood", "") != update_data["mood"]:
+        bump_stats(user_id, {
+            f"moods.{_mood_key(previous.get('mood', ''))}": -1,
+            f"moods.{_mood_key(update_data['mood'])}": 1
+        })
     
     # Return the updated entry
-    entry = journal_entries.find_one({"_id": ObjectId(entry_id)})
-    entry["_id"] = str(entry["_id"])
-    entry["user_id"] = str(entry["user_id"])
-    entry["created_at"] = entry["created_at"].isoformat()
-    entry["updated_at"] = entry["updated_at"].isoformat()
-    
+    entry = {**previous, **update_data}
     return jsonify(entry)
 
 @bp.route("/entries/<entry_id>", methods=["DELETE"])
@@ -141,73 +304,51 @@ def delete_entry(entry_id):
     """Delete a journal entry"""
     user_id = get_jwt_identity()
     
-    result = journal_entries.delete_one({
-        "_id": ObjectId(entry_id),
-        "user_id": ObjectId(user_id)
-    })
+    deleted = journal_entries.find_one_and_delete(
+        {"_id": ObjectId(entry_id), "user_id": ObjectId(user_id)},
+        projection={"mood": 1, "created_at": 1}
+    )
     
-    if result.deleted_count == 0:
+    if deleted is None:
         return jsonify({"error": "Entry not found"}), 404
+    invalidate_counts(user_id)
+    bump_stats(user_id, _rollup_inc(deleted.get("mood", ""), deleted["created_at"], -1))
     
     return jsonify({"message": "Entry deleted successfully"})
 
 @bp.route("/entries/stats", methods=["GET"])
 @jwt_required()
 def get_journal_stats():
-    """Get journal statistics for the user"""
+    """Get journal statistics for the user, read from their rollup document"""
     user_id = get_jwt_identity()
     
-    # Total entries
-    total_entries = journal_entries.count_documents({"user_id": ObjectId(user_id)})
+    rollup = get_rollup(user_id)
     
     # Entries by mood
-    mood_stats = list(journal_entries.aggregate([
-        {"$match": {"user_id": ObjectId(user_id)}},
-        {"$group": {"_id": "$mood", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]))
-    
-    # Entries by month (last 6 months)
-    six_months_ago = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    for _ in range(6):
-        six_months_ago = six_months_ago.replace(month=six_months_ago.month - 1)
-    
-    monthly_stats = list(journal_entries.aggregate([
-        {"$match": {
-            "user_id": ObjectId(user_id),
-            "created_at": {"$gte": six_months_ago}
-        }},
-        {"$group": {
-            "_id": {
-                "year": {"$year": "$created_at"},
-                "month": {"$month": "$created_at"}
-            },
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"_id.year": 1, "_id.month": 1}}
-    ]))
+    mood_stats = sorted(
+        ({"_id": _mood_from_key(k), "count": n} for k, n in rollup.get("moods", {}).items() if n > 0),
+        key=lambda m: (-m["count"], m["_id"])
+    )
+    
+    # Entries by month (this month and the 6 before it)
+    now = datetime.now()
+    first_month = (now.year * 12 + now.month - 1) - 6
+    monthly_stats = []
+    for key, n in sorted(rollup.get("months", {}).items()):
+        year, month = map(int, key.split("-"))
+        if n > 0 and year * 12 + month - 1 >= first_month:
+            monthly_stats.append({"_id": {"year": year, "month": month}, "count": n})
     
     # Entries by day (last 7 days)
-    seven_days_ago = datetime.now() - timedelta(days=7)
-    
-    daily_stats = list(journal_entries.aggregate([
-        {"$match": {
-            "user_id": ObjectId(user_id),
-            "created_at": {"$gte": seven_days_ago}
-        }},
-        {"$group": {
-            "_id": {
-                "year": {"$year": "$created_at"},
-                "month": {"$month": "$created_at"},
-                "day": {"$dayOfMonth": "$created_at"}
-            },
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"_id.year": 1, "_id.month": 1, "_id.day": 1}}
-    ]))
+    first_day = f"{now - timedelta(days=7):%Y-%m-%d}"
+    daily_stats = []
+    for key, n in sorted(rollup.get("days", {}).items()):
+        if n > 0 and key >= first_day:
+            year, month, day = map(int, key.split("-"))
+            daily_stats.append({"_id": {"year": year, "month": month, "day": day}, "count": n})
     
     return jsonify({
-        "total_entries": total_entries,
+        "total_entries": rollup.get("total", 0),
         "mood_stats": mood_stats,
         "monthly_stats": monthly_stats,
         "daily_stats": daily_stats
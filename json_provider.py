@@ -0,0 +1,56 @@
+'''Shared JSON serialization for every response.
+
+Registered as the Flask JSON provider (app.json), so jsonify() and the
+streaming encoder in json_stream.py both write ObjectId as its hex string and
+datetime/date as ISO 8601, the same text routes used to build by hand with
+str() and .isoformat(). orjson does the encoding when it is installed.'''
+import json
+from datetime import date, datetime
+from bson import ObjectId
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    _loads = orjson.loads
+else:
+    def dumps_bytes(obj):
+        return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+    _loads = json.loads
+
+
+def public(doc, *hidden):
+    """`doc` as sent to clients: _id renamed to id and the `hidden` fields dropped"""
+    if "_id" in doc:
+        doc["id"] = doc.pop("_id")
+    for field in hidden:
+        doc.pop(field, None)
+    return doc
+
+
+class FastJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return _loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype="application/json")
@@ -0,0 +1,55 @@
+'''Streams cursor results to the client as a JSON array or NDJSON.
+
+Documents are encoded one at a time and sent in batches, so memory stays
+flat however many a user has, and the first bytes go out before the query
+has finished. Clients opt into NDJSON with ?format=ndjson or
+"Accept: application/x-ndjson"; everyone else gets the same JSON array
+jsonify() used to return.'''
+import os
+from flask import Response, request
+from json_provider import dumps_bytes
+
+# Documents fetched per MongoDB round trip and encoded per chunk written to the socket
+STREAM_BATCH_SIZE = int(os.getenv("JSON_STREAM_BATCH_SIZE", "200"))
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def wants_ndjson():
+    if request.args.get("format") == "ndjson":
+        return True
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def encode_stream(cursor, transform, ndjson=False, batch_size=STREAM_BATCH_SIZE):
+    """Yield the encoded documents of `cursor` in chunks of `batch_size` documents"""
+    cursor.batch_size(batch_size)
+    separator = b"\n" if ndjson else b","
+    try:
+        if not ndjson:
+            yield b"["
+        chunk = []
+        first = True
+        for doc in cursor:
+            encoded = dumps_bytes(transform(doc))
+            chunk.append(encoded if (first or ndjson) else separator + encoded)
+            if ndjson:
+                chunk.append(separator)
+            first = False
+            if len(chunk) >= batch_size:
+                yield b"".join(chunk)
+                chunk = []
+        if not ndjson:
+            chunk.append(b"]")
+        if chunk:
+            yield b"".join(chunk)
+    finally:
+        cursor.close()
+
+
+def stream_documents(cursor, transform, batch_size=STREAM_BATCH_SIZE):
+    """Response streaming `transform(doc)` for every document of `cursor`"""
+    ndjson = wants_ndjson()
+    return Response(
+        encode_stream(cursor, transform, ndjson, batch_size),
+        mimetype=NDJSON_MIMETYPE if ndjson else "application/json"
+    )
@@ -0,0 +1,119 @@
+import threading
+
+# Minimal in-process metrics registry rendered in the Prometheus text format.
+# Each gunicorn worker keeps its own values, so scrape every worker or sum them.
+
+_registry = []
+_lock = threading.Lock()
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    inner = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + inner + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def _samples(self):
+        with _lock:
+            return [(self.name, _format_labels(self.label_names, k), v) for k, v in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), fn=None):
+        """`fn`, if given, is called at scrape time and returns the current value"""
+        super().__init__(name, help_text, labels)
+        self._fn = fn
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self._fn is not None:
+            return [(self.name, "", self._fn())]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def _samples(self):
+        samples = []
+        with _lock:
+            for key, state in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, state["counts"]):
+                    cumulative += count
+                    labels = _format_labels(self.label_names, key, [("le", bound)])
+                    samples.append((self.name + "_bucket", labels, cumulative))
+                labels = _format_labels(self.label_names, key, [("le", "+Inf")])
+                samples.append((self.name + "_bucket", labels, state["count"]))
+                labels = _format_labels(self.label_names, key)
+                samples.append((self.name + "_sum", labels, state["sum"]))
+                samples.append((self.name + "_count", labels, state["count"]))
+        return samples
+
+
+def render():
+    """Render every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in list(_registry):
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric._samples():
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,92 @@
+'''Moves chat messages out of the embedded `messages` array on chat_sessions
+into the chat_messages collection, one document per message, and fills in
+the summary fields /history lists sessions by (first_user_message,
+last_message_time) and the user_id /search scopes messages by.
+
+Safe to re-run: messages are upserted by (session_id, seq), and the array is
+only removed from a session once all of its messages have been written.
+Run it before deploying code that reads from chat_messages. Until a session
+has been migrated, appending a message to it fails instead of restarting seq
+at 1 underneath the messages still to be migrated:
+    MONGO_URI=... python migrate_messages.py [--batch-size 500] [--dry-run]'''
+import argparse
+from dotenv import load_dotenv
+load_dotenv()
+from pymongo import UpdateOne
+from indexes import ensure_indexes
+from db import chats, messages, HISTORY_PREVIEW_CHARS
+
+
+def summary_fields(first_user_text, last_timestamp):
+    fields = {}
+    if first_user_text is not None:
+        fields["first_user_message"] = first_user_text[:HISTORY_PREVIEW_CHARS]
+    if last_timestamp is not None:
+        fields["last_message_time"] = last_timestamp
+    return fields
+
+
+def migrate_session(session, batch_size, dry_run):
+    embedded = session.get("messages") or []
+    if dry_run:
+        return len(embedded)
+    for start in range(0, len(embedded), batch_size):
+        ops = [
+            UpdateOne(
+                {"session_id": session["_id"], "seq": seq},
+                {"$setOnInsert": {
+                    "user_id": session.get("user_id"),
+                    "sender": msg.get("sender"),
+                    "text": msg.get("text", ""),
+                    "timestamp": msg.get("timestamp") or session.get("timestamp"),
+                }},
+                upsert=True
+            )
+            for seq, msg in enumerate(embedded[start:start + batch_size], start=start + 1)
+        ]
+        messages.bulk_write(ops, ordered=False)
+    first_user = next((m.get("text", "") for m in embedded if m.get("sender") == "user"), None)
+    last_time = embedded[-1].get("timestamp") if embedded else None
+    chats.update_one(
+        {"_id": session["_id"]},
+        {"$set": {"message_count": len(embedded), **summary_fields(first_user, last_time)}, "$unset": {"messages": ""}}
+    )
+    return len(embedded)
+
+
+def backfill_summary(session, dry_run):
+    """Summary fields for sessions already stored in chat_messages before /history used them"""
+    if dry_run:
+        return
+    first_user = messages.find_one({"session_id": session["_id"], "sender": "user"}, sort=[("seq", 1)])
+    last = messages.find_one({"session_id": session["_id"]}, sort=[("seq", -1)])
+    fields = summary_fields(first_user and first_user["text"], last and last["timestamp"])
+    if fields:
+        chats.update_one({"_id": session["_id"]}, {"$set": fields})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500, help="messages written per bulk_write")
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be moved")
+    args = parser.parse_args()
+
+    if not args.dry_run:
+        ensure_indexes()  # the unique (session_id, seq) index makes the upserts idempotent
+    sessions = moved = 0
+    for session in chats.find({"messages": {"$exists": True}}, {"messages": 1, "timestamp": 1, "user_id": 1}):
+        moved += migrate_session(session, args.batch_size, args.dry_run)
+        sessions += 1
+    # Messages written before they carried user_id, which /search filters on
+    for session_id in ([] if args.dry_run else messages.distinct("session_id", {"user_id": {"$exists": False}})):
+        session = chats.find_one({"_id": session_id}, {"user_id": 1})
+        if session:
+            messages.update_many({"session_id": session_id, "user_id": {"$exists": False}},
+                                 {"$set": {"user_id": session["user_id"]}})
+
+    backfilled = 0
+    for session in chats.find({"message_count": {"$gt": 0}, "last_message_time": {"$exists": False}}, {"_id": 1}):
+        backfill_summary(session, args.dry_run)
+        backfilled += 1
+    verb = "Would move" if args.dry_run else "Moved"
+    print(f"{verb} {moved} messages from {sessions} sessions, summary fields for {backfilled} more")
@@ -0,0 +1,163 @@
+'''MongoDB client factory.
+
+Clients are created lazily, on first use, once per process: a client made in
+a gunicorn --preload master is never reused by the forked workers, which
+pymongo warns is unsafe. Modules keep their module-level collections
+(`chats = db["chat_sessions"]`); those are proxies that resolve to this
+process's client on every call.
+
+Tuning comes from the environment; anything unset keeps pymongo's default
+(or what MONGO_URI says):
+    MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_CONNECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_COMPRESSORS (e.g. "zstd,snappy,zlib"; zstd and snappy need their
+    python packages), MONGO_RETRY_WRITES, MONGO_WRITE_CONCERN (e.g. "majority"
+    or "1"), MONGO_APP_NAME'''
+import os
+import threading
+from pymongo import MongoClient, monitoring
+from metrics import Counter, Gauge, Histogram
+
+# env var -> (MongoClient option, type)
+_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "MONGO_COMPRESSORS": ("compressors", str),
+    "MONGO_RETRY_WRITES": ("retryWrites", lambda v: v.lower() in ("1", "true", "yes")),
+    "MONGO_WRITE_CONCERN": ("w", lambda v: int(v) if v.isdigit() else v),
+    "MONGO_APP_NAME": ("appname", str),
+}
+
+pool_wait = Histogram(
+    "mongo_pool_wait_seconds", "Time spent waiting to check a connection out of the MongoDB pool",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+pool_checkout_failures = Counter(
+    "mongo_pool_checkout_failures_total", "Connection checkouts that failed, by reason", labels=("reason",)
+)
+pool_checked_out = Gauge(
+    "mongo_pool_checked_out_connections", "Connections currently checked out of this process's pools"
+)
+pool_max_size = Gauge(
+    "mongo_pool_max_size", "Configured maxPoolSize (per server)",
+    fn=lambda: client_options().get("maxPoolSize", 100)
+)
+
+
+class _PoolListener(monitoring.ConnectionPoolListener):
+    """Records how long requests wait for a pooled connection; long waits mean the pool is too small for the worker's concurrency"""
+
+    def connection_checked_out(self, event):
+        pool_checked_out.inc()
+        pool_wait.observe(event.duration)
+
+    def connection_checked_in(self, event):
+        pool_checked_out.dec()
+
+    def connection_check_out_failed(self, event):
+        pool_checkout_failures.inc(reason=event.reason)
+        pool_wait.observe(event.duration)
+
+    def connection_check_out_started(self, event): pass
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+
+
+commands_sent = Counter("mongo_commands_total", "Commands sent to MongoDB, by command name", labels=("command",))
+_tally = threading.local()
+
+
+class _CommandListener(monitoring.CommandListener):
+    """Counts commands, in total and per thread (see command_count)"""
+
+    def started(self, event):
+        commands_sent.inc(command=event.command_name)
+        _tally.count = getattr(_tally, "count", 0) + 1
+
+    def succeeded(self, event): pass
+    def failed(self, event): pass
+
+
+def command_count():
+    """Commands this thread has sent so far; the difference of two readings is the round trips in between"""
+    return getattr(_tally, "count", 0)
+
+
+def client_options():
+    options = {}
+    for env, (option, convert) in _OPTIONS.items():
+        value = os.getenv(env)
+        if value:
+            options[option] = convert(value)
+    return options
+
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_client():
+    """This process's MongoClient, created on first use"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = MongoClient(
+                    os.environ.get("MONGO_URI"),
+                    event_listeners=[_PoolListener(), _CommandListener()],
+                    **client_options()
+                )
+    return _client
+
+
+def _after_fork_in_child():
+    # Forget the parent's client (and a lock another thread may have held mid-fork)
+    global _client, _lock
+    _client = None
+    _lock = threading.Lock()
+    pool_checked_out.set(0)
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class LazyCollection:
+    """Stands in for a pymongo Collection; every attribute comes from this process's client"""
+
+    def __init__(self, db_name, name):
+        self._db_name = db_name
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_client()[self._db_name][self._name], attr)
+
+    def __repr__(self):
+        return f"LazyCollection({self._db_name!r}, {self._name!r})"
+
+
+class LazyDatabase:
+    """Stands in for a pymongo Database: db["name"] gives a LazyCollection"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getitem__(self, name):
+        return LazyCollection(self.name, name)
+
+    def __getattr__(self, attr):
+        return getattr(get_client()[self.name], attr)
+
+
+def database(name):
+    return LazyDatabase(name)
@@ -0,0 +1,66 @@
+import os
+import json
+from metrics import Counter
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # fall back to the stdlib parser
+    _loads = json.loads
+
+# Bytes requested per socket read; large reads mean fewer Python-level iterations per reply
+READ_CHUNK_SIZE = int(os.getenv("OLLAMA_READ_CHUNK_SIZE", "16384"))
+
+parse_errors = Counter("ollama_ndjson_parse_errors_total", "Model stream lines that were not valid JSON", labels=("backend",))
+
+
+class NDJSONDecoder:
+    """Incremental newline-delimited JSON decoder working on raw bytes.
+
+    feed() takes whatever the socket returned and gives back every complete
+    frame in it; a partial trailing line is kept until the next read.
+    Invalid lines are counted, not raised. The last frame with `done` set
+    is kept as `final` (Ollama's timing and token statistics).
+    """
+
+    def __init__(self, backend=""):
+        self.backend = backend
+        self.final = None
+        self.frames = 0
+        self.errors = 0
+        self._buffer = b""
+
+    def feed(self, data):
+        if not data:
+            return []
+        end = data.rfind(b"\n")
+        if end < 0:
+            self._buffer += data
+            return []
+        lines = (self._buffer + data[:end]).split(b"\n")
+        self._buffer = data[end + 1:]
+        return [frame for frame in map(self._decode, lines) if frame is not None]
+
+    def close(self):
+        """Decode a final line that wasn't newline-terminated"""
+        line, self._buffer = self._buffer, b""
+        frame = self._decode(line)
+        return [frame] if frame is not None else []
+
+    def _decode(self, line):
+        if not line.strip():
+            return None
+        try:
+            frame = _loads(line)
+        except ValueError:
+            self.errors += 1
+            parse_errors.inc(backend=self.backend)
+            return None
+        if not isinstance(frame, dict):
+            self.errors += 1
+            parse_errors.inc(backend=self.backend)
+            return None
+        self.frames += 1
+        if frame.get("done"):
+            self.final = frame
+        return frame
@@ -1,21 +1,283 @@
+import os
+import time
+import asyncio
+import threading
+import httpx
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from ollama_pool import BackendPool
+from metrics import Counter, Histogram
+from ndjson import NDJSONDecoder, READ_CHUNK_SIZE
 
-OLLAMA_URL = "http://34.131.29.49:11434/api/generate"
-MODEL = "phi"
+# Comma-separated base URLs of the model hosts; OLLAMA_URL is the older single-host setting
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://34.131.29.49:11434/api/generate")
+OLLAMA_HOSTS = [h.strip() for h in os.getenv("OLLAMA_HOSTS", OLLAMA_URL.replace("/api/generate", "")).split(",") if h.strip()]
+MODEL = os.getenv("OLLAMA_MODEL", "phi")
 
-def stream_gemma_response(prompt: str):
-    response = requests.post(OLLAMA_URL, json={
+# Keep the model resident on every backend so users never wait on a cold load
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+KEEP_ALIVE_REFRESH = float(os.getenv("OLLAMA_KEEP_ALIVE_REFRESH", "300"))  # seconds; keep well under KEEP_ALIVE
+WARMUP_TIMEOUT = float(os.getenv("OLLAMA_WARMUP_TIMEOUT", "120"))
+COLD_LOAD_THRESHOLD = float(os.getenv("OLLAMA_COLD_LOAD_THRESHOLD", "0.5"))  # seconds of load time that count as cold
+
+# Connection pool settings for the model backend
+CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "60"))  # max gap between streamed chunks
+POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "10"))
+MAX_STREAMS = int(os.getenv("OLLAMA_MAX_STREAMS", str(POOL_SIZE)))
+STREAM_ACQUIRE_TIMEOUT = float(os.getenv("OLLAMA_STREAM_ACQUIRE_TIMEOUT", "5"))
+
+
+class OllamaError(Exception):
+    """Raised when the model backend is unreachable, times out or is saturated"""
+
+
+LLM_LABELS = ("model", "backend")
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+ttft_seconds = Histogram("llm_time_to_first_token_seconds", "Time from sending the request to the first reply token", labels=LLM_LABELS)
+inter_token_seconds = Histogram("llm_inter_token_seconds", "Gap between consecutive reply tokens", labels=LLM_LABELS,
+                                buckets=(0.005, 0.01, 0.02, 0.035, 0.05, 0.1, 0.2, 0.5, 1, 2, 5))
+generation_seconds = Histogram("llm_generation_seconds", "Wall time of a complete model stream", labels=LLM_LABELS)
+prompt_eval_seconds = Histogram("llm_prompt_eval_seconds", "Model-reported prompt evaluation time", labels=LLM_LABELS)
+prompt_tokens = Histogram("llm_prompt_tokens", "Prompt tokens evaluated per request", labels=LLM_LABELS, buckets=TOKEN_BUCKETS)
+generated_tokens = Histogram("llm_generated_tokens", "Tokens generated per reply", labels=LLM_LABELS, buckets=TOKEN_BUCKETS)
+model_load_seconds = Histogram("llm_model_load_seconds", "Model load time reported by the backend", labels=LLM_LABELS)
+cold_loads = Counter("llm_cold_loads_total", "Requests that had to load the model first", labels=LLM_LABELS + ("source",))
+tokens_per_second = Histogram("llm_tokens_per_second", "Model-reported generation speed", labels=LLM_LABELS,
+                              buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200))
+
+
+def _record_load(backend_url, seconds, source):
+    model_load_seconds.observe(seconds, model=MODEL, backend=backend_url)
+    if seconds >= COLD_LOAD_THRESHOLD:
+        cold_loads.inc(model=MODEL, backend=backend_url, source=source)
+        print(f"[Ollama] Cold load of {MODEL} on {backend_url} took {seconds:.1f}s ({source})")
+
+
+class _StreamTimer:
+    """Latency bookkeeping for one model stream"""
+
+    def __init__(self, backend):
+        self.labels = {"model": MODEL, "backend": backend.url}
+        self.started = time.monotonic()
+        self.first_token_at = None
+        self.last_token_at = None
+
+    def token(self):
+        now = time.monotonic()
+        if self.first_token_at is None:
+            self.first_token_at = now
+            ttft_seconds.observe(now - self.started, **self.labels)
+        else:
+            inter_token_seconds.observe(now - self.last_token_at, **self.labels)
+        self.last_token_at = now
+
+    def finish(self, final):
+        """Record totals; Ollama's durations in the final frame are in nanoseconds"""
+        elapsed = time.monotonic() - self.started
+        generation_seconds.observe(elapsed, **self.labels)
+        if final is None:
+            return
+        final["backend"] = self.labels["backend"]
+        final["elapsed_seconds"] = elapsed
+        if self.first_token_at is not None:
+            final["ttft_seconds"] = self.first_token_at - self.started
+        if "prompt_eval_count" in final:
+            prompt_tokens.observe(final["prompt_eval_count"], **self.labels)
+        if final.get("prompt_eval_duration"):
+            prompt_eval_seconds.observe(final["prompt_eval_duration"] / 1e9, **self.labels)
+        if final.get("load_duration"):
+            _record_load(self.labels["backend"], final["load_duration"] / 1e9, "request")
+        if "eval_count" in final:
+            generated_tokens.observe(final["eval_count"], **self.labels)
+            if final.get("eval_duration"):
+                tokens_per_second.observe(final["eval_count"] / (final["eval_duration"] / 1e9), **self.labels)
+
+
+# One keep-alive session shared by every chat turn in this process
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=len(OLLAMA_HOSTS), pool_maxsize=POOL_SIZE, pool_block=True, max_retries=0)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+def warm_up(backend):
+    """Load MODEL on a backend, or refresh its keep_alive if it is already loaded"""
+    started = time.monotonic()
+    try:
+        response = _session.post(f"{backend.url}/api/generate", json={
+            "model": MODEL,
+            "keep_alive": KEEP_ALIVE,
+            "stream": False
+        }, timeout=(CONNECT_TIMEOUT, WARMUP_TIMEOUT))
+        response.raise_for_status()
+        data = response.json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"[Ollama] Warm-up of {MODEL} on {backend.url} failed: {e}")
+        return False
+    # Load-only requests don't always report load_duration; fall back to wall time
+    load_seconds = data.get("load_duration", 0) / 1e9 or time.monotonic() - started
+    _record_load(backend.url, load_seconds, "warmup")
+    backend_pool.mark_warm(backend)
+    return True
+
+backend_pool = BackendPool(OLLAMA_HOSTS, _session, on_readmit=warm_up)
+
+_warmup_lock = threading.Lock()
+_warmup_pid = None
+
+def start_model_warmup():
+    """Warm every backend now and keep refreshing keep_alive; safe to call repeatedly"""
+    global _warmup_pid
+    # Threads don't survive a fork, so each worker process runs its own
+    with _warmup_lock:
+        if _warmup_pid == os.getpid():
+            return
+        _warmup_pid = os.getpid()
+    threading.Thread(target=_keep_model_warm, name="ollama-warmup", daemon=True).start()
+
+def _keep_model_warm():
+    while True:
+        threads = [threading.Thread(target=warm_up, args=(b,), daemon=True) for b in backend_pool.backends if b.healthy]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if KEEP_ALIVE_REFRESH <= 0:
+            return
+        time.sleep(KEEP_ALIVE_REFRESH)
+
+# Bounds the number of streams open against the backend at once
+_stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+def _build_payload(prompt, context):
+    payload = {
         "model": MODEL,
         "prompt": prompt,
-        "stream": True
-    }, stream=True)
+        "stream": True,
+        "keep_alive": KEEP_ALIVE
+    }
+    if context:
+        payload["context"] = context
+    return payload
+
+def _frame_text(frame, final):
+    """Return the reply text in one decoded frame, recording the final frame into `final`"""
+    if "error" in frame:
+        raise OllamaError(f"Model backend reported an error: {frame['error']}")
+    if frame.get("done"):
+        final.update(frame)
+    return frame.get("response", "")
 
-    for line in response.iter_lines():
-        if line:
+def stream_gemma_response(prompt: str, context=None, final=None, session_id=None):
+    """Yield reply text chunks for `prompt`.
+
+    Pass the `context` returned by a previous turn to continue that
+    conversation. If `final` is a dict it is filled with the last frame
+    (timings and the new `context`) once the stream completes, plus the
+    backend used and the measured time to first token.
+    `session_id` keeps a chat on the same backend between turns.
+    """
+    start_model_warmup()  # no-op unless this worker was forked after startup
+    if not _stream_slots.acquire(timeout=STREAM_ACQUIRE_TIMEOUT):
+        raise OllamaError("Too many concurrent model streams")
+    backend = backend_pool.acquire(session_id)
+    timer = _StreamTimer(backend)
+    if final is None:
+        final = {}
+    failed = False
+    try:
+        try:
+            response = _session.post(f"{backend.url}/api/generate", json=_build_payload(prompt, context), stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            # A 4xx (e.g. unknown model) is our fault, not the host's
+            failed = e.response.status_code >= 500
+            raise OllamaError(f"Model backend request failed: {e}") from e
+        except requests.RequestException as e:
+            failed = True
+            raise OllamaError(f"Model backend request failed: {e}") from e
+
+        # Closing the response hands the connection back to the pool
+        with response:
+            decoder = NDJSONDecoder(backend.url)
             try:
-                data = json.loads(line.decode('utf-8'))
-                yield data.get("response", "")
-            except:
-                continue
+                for data in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+                    for frame in decoder.feed(data):
+                        text = _frame_text(frame, final)
+                        if text:
+                            timer.token()
+                        yield text
+                for frame in decoder.close():
+                    yield _frame_text(frame, final)
+                timer.finish(final)
+            except requests.RequestException as e:
+                failed = True
+                raise OllamaError(f"Model stream interrupted: {e}") from e
+    finally:
+        backend_pool.release(backend, failed=failed)
+        _stream_slots.release()
+
+
+# Async client for the ASGI chat path: one per process, created on first use and closed at
+# lifespan shutdown. It is bound to the loop that first uses it, which is fine because each
+# uvicorn worker runs a single event loop
+_async_client = None
 
+def _get_async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=STREAM_ACQUIRE_TIMEOUT),
+            limits=httpx.Limits(max_connections=POOL_SIZE * len(OLLAMA_HOSTS), max_keepalive_connections=POOL_SIZE * len(OLLAMA_HOSTS))
+        )
+    return _async_client
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+async def astream_gemma_response(prompt: str, context=None, final=None, session_id=None):
+    """Async twin of stream_gemma_response for the ASGI app"""
+    start_model_warmup()  # no-op unless this worker was forked after startup
+    if not _stream_slots.acquire(blocking=False):
+        # Only park a thread on the semaphore when it is actually contended
+        if not await asyncio.to_thread(_stream_slots.acquire, True, STREAM_ACQUIRE_TIMEOUT):
+            raise OllamaError("Too many concurrent model streams")
+    backend = backend_pool.acquire(session_id)
+    timer = _StreamTimer(backend)
+    if final is None:
+        final = {}
+    failed = False
+    try:
+        request = _get_async_client().build_request("POST", f"{backend.url}/api/generate", json=_build_payload(prompt, context))
+        try:
+            response = await _get_async_client().send(request, stream=True)
+        except httpx.HTTPError as e:
+            failed = True
+            raise OllamaError(f"Model backend request failed: {e}") from e
+        try:
+            if response.status_code >= 400:
+                failed = response.status_code >= 500
+                raise OllamaError(f"Model backend request failed: HTTP {response.status_code}")
+            decoder = NDJSONDecoder(backend.url)
+            try:
+                async for data in response.aiter_bytes():
+                    for frame in decoder.feed(data):
+                        text = _frame_text(frame, final)
+                        if text:
+                            timer.token()
+                        yield text
+                for frame in decoder.close():
+                    yield _frame_text(frame, final)
+                timer.finish(final)
+            except httpx.HTTPError as e:
+                failed = True
+                raise OllamaError(f"Model stream interrupted: {e}") from e
+        finally:
+            await response.aclose()
+    finally:
+        backend_pool.release(backend, failed=failed)
+        _stream_slots.release()
@@ -0,0 +1,134 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from metrics import Counter, Gauge
+
+HEALTH_CHECK_INTERVAL = float(os.getenv("OLLAMA_HEALTH_CHECK_INTERVAL", "10"))  # seconds
+HEALTH_CHECK_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_CHECK_TIMEOUT", "2"))
+AFFINITY_MAX_SESSIONS = int(os.getenv("OLLAMA_AFFINITY_MAX_SESSIONS", "10000"))
+
+backend_outstanding = Gauge("ollama_backend_outstanding_streams", "Streams in flight per model backend", labels=("backend",))
+backend_warm = Gauge("ollama_backend_warm", "1 once the model has been loaded on the backend", labels=("backend",))
+backend_healthy = Gauge("ollama_backend_healthy", "1 if the model backend is in rotation", labels=("backend",))
+backend_ejections = Counter("ollama_backend_ejections_total", "Times a model backend was taken out of rotation", labels=("backend",))
+
+
+class Backend:
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        self.warm = False  # model known to be loaded
+        self.outstanding = 0
+        self.ejected_at = None
+
+
+class BackendPool:
+    """Routes chat streams across model hosts.
+
+    Picks the healthy host with the fewest outstanding streams, breaking
+    ties in favour of hosts that already have the model loaded, keeps a session on the host
+    that served it last (so cached context stays warm), ejects a host when
+    a request to it fails and re-admits it once a background health probe
+    succeeds. `on_readmit` is called in a new thread for a re-admitted host.
+    """
+
+    def __init__(self, urls, http, check_interval=HEALTH_CHECK_INTERVAL, check_timeout=HEALTH_CHECK_TIMEOUT, on_readmit=None):
+        if not urls:
+            raise ValueError("At least one model backend URL is required")
+        self.backends = [Backend(url.rstrip("/")) for url in urls]
+        self.http = http
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.on_readmit = on_readmit
+        self._lock = threading.Lock()
+        self._affinity = OrderedDict()  # session_id -> Backend
+        self._checker_pid = None
+        for backend in self.backends:
+            backend_healthy.set(1, backend=backend.url)
+            backend_outstanding.set(0, backend=backend.url)
+            backend_warm.set(0, backend=backend.url)
+
+    def acquire(self, session_id=None):
+        """Pick a backend for a new stream and count it as outstanding"""
+        self._ensure_health_checks()
+        with self._lock:
+            backend = self._affinity.get(session_id) if session_id else None
+            if backend is None or not backend.healthy:
+                healthy = [b for b in self.backends if b.healthy]
+                # Load first, warmth only breaks ties (a host whose warm-up is pending
+                # or failed still takes its share); fail open if all are down
+                candidates = healthy or self.backends
+                backend = min(candidates, key=lambda b: (b.outstanding, not b.warm))
+            if session_id:
+                self._affinity[session_id] = backend
+                self._affinity.move_to_end(session_id)
+                while len(self._affinity) > AFFINITY_MAX_SESSIONS:
+                    self._affinity.popitem(last=False)
+            backend.outstanding += 1
+            backend_outstanding.set(backend.outstanding, backend=backend.url)
+            return backend
+
+    def release(self, backend, failed=False):
+        with self._lock:
+            backend.outstanding -= 1
+            backend_outstanding.set(backend.outstanding, backend=backend.url)
+        if failed:
+            self.eject(backend)
+
+    def mark_warm(self, backend, warm=True):
+        backend.warm = warm
+        backend_warm.set(1 if warm else 0, backend=backend.url)
+
+    def eject(self, backend):
+        with self._lock:
+            if not backend.healthy:
+                return
+            backend.healthy = False
+            backend.ejected_at = time.monotonic()
+            for session_id in [s for s, b in self._affinity.items() if b is backend]:
+                del self._affinity[session_id]
+        backend_healthy.set(0, backend=backend.url)
+        backend_ejections.inc(backend=backend.url)
+        print(f"[Ollama] Backend {backend.url} ejected from rotation")
+
+    def check(self, backend):
+        """Probe one backend and update its health"""
+        try:
+            response = self.http.get(f"{backend.url}/api/tags", timeout=self.check_timeout)
+            ok = response.status_code == 200
+            response.close()
+        except Exception:
+            ok = False
+        if not ok:
+            self.eject(backend)
+        elif not backend.healthy:
+            with self._lock:
+                backend.healthy = True
+                backend.ejected_at = None
+            # A restarted host comes back without the model loaded
+            self.mark_warm(backend, False)
+            backend_healthy.set(1, backend=backend.url)
+            print(f"[Ollama] Backend {backend.url} back in rotation")
+            if self.on_readmit:
+                threading.Thread(target=self.on_readmit, args=(backend,), daemon=True).start()
+        return ok
+
+    def check_all(self):
+        for backend in self.backends:
+            self.check(backend)
+
+    def _ensure_health_checks(self):
+        # Threads don't survive a fork, so start the checker in each worker process
+        if self._checker_pid == os.getpid() or self.check_interval <= 0:
+            return
+        with self._lock:
+            if self._checker_pid == os.getpid():
+                return
+            self._checker_pid = os.getpid()
+        threading.Thread(target=self._run_health_checks, name="ollama-health", daemon=True).start()
+
+    def _run_health_checks(self):
+        while True:
+            time.sleep(self.check_interval)
+            self.check_all()
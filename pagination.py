@@ -0,0 +1,54 @@
+'''Keyset (cursor) pagination for listings sorted newest first by (<time field>, _id).
+
+Unlike skip/limit, the cost of a page does not grow with how far back it is,
+and rows inserted while a client is paging do not shift later pages.'''
+import base64
+from datetime import datetime
+from bson import ObjectId
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(when, _id):
+    """Opaque cursor pointing just past the given row"""
+    raw = f"{when.isoformat()}|{_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        when, _id = raw.split("|")
+        return datetime.fromisoformat(when), ObjectId(_id)
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+
+
+def after_cursor(field, cursor):
+    """Query fragment matching the rows that come after `cursor` in (field desc, _id desc) order"""
+    when, _id = decode_cursor(cursor)
+    return {"$or": [
+        {field: {"$lt": when}},
+        {field: when, "_id": {"$lt": _id}}
+    ]}
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    try:
+        size = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
+
+
+def next_cursor(rows, field, limit):
+    """Cursor for the page after `rows`, or None when this was the last page"""
+    if len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(last[field], last["_id"])
@@ -2,13 +2,21 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from bson import ObjectId
 from datetime import datetime, timedelta
-from db import client
+from mongo import database
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from indexes import register_indexes
+from json_stream import stream_documents
+from json_provider import public
 
 bp = Blueprint('planner', __name__)
-db = client["mental_health_db"]
+db = database("mental_health_db")
 todos = db["todos"]
 timetables = db["timetables"]
 
+register_indexes(todos, IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)]))
+# start_time second so the same index serves the slot lookup and the start_time sort
+register_indexes(timetables, IndexModel([("user_id", ASCENDING), ("start_time", ASCENDING), ("day", ASCENDING), ("end_time", ASCENDING)]))
+
 # POST /api/todos - create a new todo
 @bp.route('/api/todos', methods=['POST'])
 @jwt_required()
@@ -33,32 +41,16 @@ def create_todo():
         'due_date': datetime.fromisoformat(due_date) if due_date else None
     }
     
-    result = todos.insert_one(todo)
-    todo['id'] = str(result.inserted_id)
-    todo['created_at'] = todo['created_at'].isoformat()
-    if todo['due_date']:
-        todo['due_date'] = todo['due_date'].isoformat()
-    del todo['_id']
-    del todo['user_id']
-    
-    return jsonify(todo), 201
+    todos.insert_one(todo)
+    return jsonify(public(todo, 'user_id')), 201
 
-# GET /api/todos - get all todos for user
+# GET /api/todos - get all todos for user (streamed; ?format=ndjson for one todo per line)
 @bp.route('/api/todos', methods=['GET'])
 @jwt_required()
 def get_todos():
     user_id = get_jwt_identity()
-    user_todos = list(todos.find({'user_id': ObjectId(user_id)}).sort('created_at', -1))
-    
-    for todo in user_todos:
-        todo['id'] = str(todo['_id'])
-        todo['created_at'] = todo['created_at'].isoformat()
-        if todo.get('due_date'):
-            todo['due_date'] = todo['due_date'].isoformat()
-        del todo['_id']
-        del todo['user_id']
-    
-    return jsonify(user_todos)
+    user_todos = todos.find({'user_id': ObjectId(user_id)}, {'user_id': 0}).sort('created_at', -1)
+    return stream_documents(user_todos, public)
 
 # PUT /api/todos/<id> - update a todo
 @bp.route('/api/todos/<todo_id>', methods=['PUT'])
@@ -119,51 +111,34 @@ def create_timetable_entry():
     if not all([day, start_time, end_time, activity]):
         return jsonify({'error': 'Day, start_time, end_time, and activity are required'}), 400
     
-    # Check if entry already exists for this day and time range
-    existing = timetables.find_one({
-        'user_id': ObjectId(user_id),
-        'day': day,
-        'start_time': start_time,
-        'end_time': end_time
-    })
-    
-    if existing:
-        # Update existing entry
-        result = timetables.update_one(
-            {'_id': existing['_id']},
-            {'$set': {'activity': activity, 'color': color}}
-        )
-        message = 'Timetable entry updated successfully'
-    else:
-        # Create new entry
-        entry = {
+    # Update the entry for this day and time range, or create it if there is none (one upsert)
+    result = timetables.update_one(
+        {
             'user_id': ObjectId(user_id),
             'day': day,
             'start_time': start_time,
-            'end_time': end_time,
-            'activity': activity,
-            'color': color,
-            'created_at': datetime.now()
-        }
-        timetables.insert_one(entry)
+            'end_time': end_time
+        },
+        {
+            '$set': {'activity': activity, 'color': color},
+            '$setOnInsert': {'created_at': datetime.now()}
+        },
+        upsert=True
+    )
+    if result.upserted_id is None:
+        message = 'Timetable entry updated successfully'
+    else:
         message = 'Timetable entry created successfully'
     
     return jsonify({'message': message})
 
-# GET /api/timetable - get all timetable entries for user
+# GET /api/timetable - get all timetable entries for user (streamed; ?format=ndjson for one entry per line)
 @bp.route('/api/timetable', methods=['GET'])
 @jwt_required()
 def get_timetable():
     user_id = get_jwt_identity()
-    entries = list(timetables.find({'user_id': ObjectId(user_id)}).sort('day', 1).sort('start_time', 1))
-    
-    for entry in entries:
-        entry['id'] = str(entry['_id'])
-        entry['created_at'] = entry['created_at'].isoformat()
-        del entry['_id']
-        del entry['user_id']
-    
-    return jsonify(entries)
+    entries = timetables.find({'user_id': ObjectId(user_id)}, {'user_id': 0}).sort('day', 1).sort('start_time', 1)
+    return stream_documents(entries, public)
 
 # DELETE /api/timetable/<id> - delete a timetable entry
 @bp.route('/api/timetable/<entry_id>', methods=['DELETE'])
@@ -182,7 +157,7 @@ def delete_timetable_entry(entry_id):
 @jwt_required()
 def get_weekly_timetable():
     user_id = get_jwt_identity()
-    entries = list(timetables.find({'user_id': ObjectId(user_id)}).sort('day', 1).sort('start_time', 1))
+    entries = timetables.find({'user_id': ObjectId(user_id)}, {'user_id': 0}).sort('day', 1).sort('start_time', 1)
     
     # Organize by day
     weekly_data = {
@@ -196,10 +171,6 @@ def get_weekly_timetable():
     }
     
     for entry in entries:
-        entry['id'] = str(entry['_id'])
-        entry['created_at'] = entry['created_at'].isoformat()
-        del entry['_id']
-        del entry['user_id']
-        weekly_data[entry['day']].append(entry)
+        weekly_data[entry['day']].append(public(entry))
     
     return jsonify(weekly_data) 
\ No newline at end of file
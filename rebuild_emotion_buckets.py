@@ -0,0 +1,17 @@
+'''Recomputes the per-day emotion analytics buckets (emotion_buckets) from the
+mood logs themselves. A user's buckets are rebuilt on first use anyway; run
+this to do every user ahead of time, and periodically to repair drift:
+    MONGO_URI=... python rebuild_emotion_buckets.py [--user <user_id>]'''
+import argparse
+from dotenv import load_dotenv
+load_dotenv()
+from emotion import emotions, rebuild_buckets
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--user", help="only rebuild this user's buckets")
+    args = parser.parse_args()
+
+    user_ids = [args.user] if args.user else emotions.distinct("user_id")
+    days = sum(rebuild_buckets(user_id) for user_id in user_ids)
+    print(f"Rebuilt {days} day buckets for {len(user_ids)} users")
@@ -0,0 +1,18 @@
+'''Recomputes the per-user journal statistics rollups (journal_stats) from the
+entries themselves, repairing any drift from failed or concurrent writes.
+Run periodically, e.g. nightly from cron:
+    MONGO_URI=... python rebuild_journal_stats.py [--user <user_id>]'''
+import argparse
+from dotenv import load_dotenv
+load_dotenv()
+from journal import journal_entries, rebuild_stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--user", help="only rebuild this user's rollup")
+    args = parser.parse_args()
+
+    user_ids = [args.user] if args.user else journal_entries.distinct("user_id")
+    for user_id in user_ids:
+        rebuild_stats(user_id)
+    print(f"Rebuilt journal stats for {len(user_ids)} users")
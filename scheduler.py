@@ -0,0 +1,176 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from metrics import Counter, Gauge, Histogram
+
+# Admission control for chat streams, applied before a request reaches the model
+MAX_ACTIVE_STREAMS = int(os.getenv("CHAT_MAX_ACTIVE_STREAMS", os.getenv("OLLAMA_MAX_STREAMS", "10")))
+MAX_STREAMS_PER_USER = int(os.getenv("CHAT_MAX_STREAMS_PER_USER", "2"))
+MAX_QUEUE_DEPTH = int(os.getenv("CHAT_MAX_QUEUE_DEPTH", "50"))
+QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "20"))  # seconds a request may wait for a slot
+
+
+class SchedulerRejected(Exception):
+    """Raised when a chat request can't be admitted; carries the HTTP status to return"""
+
+    def __init__(self, message, status, retry_after=1):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _AsyncWaiter:
+    """Queue ticket of a coroutine waiting in aacquire(), woken on its own event loop"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def wake(self):
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:  # loop already closed
+            pass
+
+
+class ChatScheduler:
+    """Global concurrency limit with a per-user cap and a bounded FIFO wait queue.
+
+    Threads wait in acquire(); coroutines wait in aacquire() without holding
+    an executor thread. Both share the same FIFO queue.
+    """
+
+    def __init__(self, max_active, max_per_user, max_queue, queue_timeout):
+        self.max_active = max_active
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queue = deque()
+        self._per_user = {}  # user_id -> streams running or queued
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    def _enqueue(self, user_id, ticket):
+        """Grant a slot right away (returns True) or queue `ticket`; call with the lock held"""
+        if self._per_user.get(user_id, 0) >= self.max_per_user:
+            rejections.inc(reason="user_limit")
+            raise SchedulerRejected("Too many chats in progress for this user", 429)
+        if not self._queue and self._active < self.max_active:
+            self._grant(user_id)
+            queue_wait.observe(0)
+            return True
+        if len(self._queue) >= self.max_queue:
+            rejections.inc(reason="queue_full")
+            raise SchedulerRejected("Chat is busy, please try again shortly", 503, retry_after=5)
+        self._queue.append(ticket)
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        return False
+
+    def _wake(self):
+        """Let every waiter re-check the queue; call with the lock held"""
+        self._cond.notify_all()
+        for ticket in self._queue:
+            if isinstance(ticket, _AsyncWaiter):
+                ticket.wake()
+
+    def acquire(self, user_id):
+        """Block until a stream slot is free and return the seconds spent queued"""
+        with self._cond:
+            ticket = object()
+            if self._enqueue(user_id, ticket):
+                return 0.0
+            started = time.monotonic()
+            deadline = started + self.queue_timeout
+            try:
+                while not (self._queue[0] is ticket and self._active < self.max_active):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        rejections.inc(reason="queue_timeout")
+                        raise SchedulerRejected("Chat is busy, please try again shortly", 503, retry_after=5)
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._queue.remove(ticket)
+                self._release_user(user_id)
+                self._wake()
+                raise
+            self._queue.popleft()
+            self._active += 1
+            # The next waiter may also fit if more than one slot opened up
+            self._wake()
+            waited = time.monotonic() - started
+            queue_wait.observe(waited)
+            return waited
+
+    async def aacquire(self, user_id):
+        """acquire() for coroutines: waits on the event loop instead of blocking a thread"""
+        ticket = _AsyncWaiter()
+        with self._cond:
+            if self._enqueue(user_id, ticket):
+                return 0.0
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        try:
+            while True:
+                with self._cond:
+                    if self._queue[0] is ticket and self._active < self.max_active:
+                        self._queue.popleft()
+                        self._active += 1
+                        self._wake()
+                        break
+                    # Cleared under the lock, so a wake-up from release() after this is not lost
+                    ticket.event.clear()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    rejections.inc(reason="queue_timeout")
+                    raise SchedulerRejected("Chat is busy, please try again shortly", 503, retry_after=5)
+                try:
+                    await asyncio.wait_for(ticket.event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._cond:
+                self._queue.remove(ticket)
+                self._release_user(user_id)
+                self._wake()
+            raise
+        waited = time.monotonic() - started
+        queue_wait.observe(waited)
+        return waited
+
+    def release(self, user_id):
+        with self._cond:
+            self._active -= 1
+            self._release_user(user_id)
+            self._wake()
+
+    def _grant(self, user_id):
+        self._active += 1
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+
+    def _release_user(self, user_id):
+        remaining = self._per_user.get(user_id, 0) - 1
+        if remaining > 0:
+            self._per_user[user_id] = remaining
+        else:
+            self._per_user.pop(user_id, None)
+
+
+scheduler = ChatScheduler(MAX_ACTIVE_STREAMS, MAX_STREAMS_PER_USER, MAX_QUEUE_DEPTH, QUEUE_TIMEOUT)
+
+queue_wait = Histogram("chat_queue_wait_seconds", "Time chat requests spent waiting for a stream slot")
+rejections = Counter("chat_rejections_total", "Chat requests rejected by admission control", labels=("reason",))
+Gauge("chat_active_streams", "Chat streams currently running", fn=lambda: scheduler.active)
+Gauge("chat_queued_requests", "Chat requests waiting for a stream slot", fn=lambda: scheduler.queued)
+Gauge("chat_max_active_streams", "Configured global stream limit", fn=lambda: scheduler.max_active)
+Gauge("chat_max_streams_per_user", "Configured per-user stream limit", fn=lambda: scheduler.max_per_user)
+Gauge("chat_max_queue_depth", "Configured wait queue capacity", fn=lambda: scheduler.max_queue)
@@ -0,0 +1,79 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from bson import ObjectId
+from pymongo.errors import ExecutionTimeout
+import os
+from db import messages
+from journal import journal_entries
+from pagination import page_size
+from text_search import literal_query, literal_terms, highlight, SNIPPET_CHARS
+
+bp = Blueprint('search', __name__)
+
+# Each collection's query is cut off after this long, so no query can hold the database
+SEARCH_MAX_TIME_MS = int(os.getenv("SEARCH_MAX_TIME_MS", "500"))
+MAX_RESULTS = 50
+SCOPES = ("journal", "chat")
+
+def _text_search(collection, user_id, query, projection, limit):
+    projection = dict(projection, score={"$meta": "textScore"})
+    return list(collection.find({"user_id": ObjectId(user_id), "$text": {"$search": query}}, projection)
+                .sort([("score", {"$meta": "textScore"})])
+                .limit(limit)
+                .max_time_ms(SEARCH_MAX_TIME_MS))
+
+def search_journal(user_id, query, terms, limit):
+    results = _text_search(journal_entries, user_id, query,
+                           {"title": 1, "content": 1, "mood": 1, "created_at": 1}, limit)
+    return [{
+        "entry_id": e["_id"],
+        "title": highlight(e.get("title", ""), terms),
+        "content": highlight(e.get("content", ""), terms, SNIPPET_CHARS),
+        "mood": e.get("mood", ""),
+        "created_at": e["created_at"],
+        "score": round(e["score"], 3)
+    } for e in results]
+
+def search_chat(user_id, query, terms, limit):
+    results = _text_search(messages, user_id, query,
+                           {"session_id": 1, "seq": 1, "sender": 1, "text": 1, "timestamp": 1}, limit)
+    return [{
+        "session_id": m["session_id"],
+        "seq": m["seq"],
+        "sender": m["sender"],
+        "text": highlight(m["text"], terms, SNIPPET_CHARS),
+        "timestamp": m["timestamp"],
+        "score": round(m["score"], 3)
+    } for m in results]
+
+@bp.route("/search", methods=["GET"])
+@jwt_required()
+def search():
+    """Ranked search over the user's journal entries and chat messages.
+
+    ?q= is treated as plain words (no regex, phrase or negation syntax);
+    ?scope=journal|chat limits it to one of them. Each match comes with
+    the [start, end) offsets of the matched words for highlighting.
+    """
+    user_id = get_jwt_identity()
+    raw_query = request.args.get("q", "")
+    scope = request.args.get("scope", "")
+    limit = page_size(request.args.get("limit"), 20, maximum=MAX_RESULTS)
+
+    query = literal_query(raw_query)
+    if not query:
+        return jsonify({"error": "Search must contain at least one word"}), 400
+    if scope and scope not in SCOPES:
+        return jsonify({"error": f"scope must be one of {', '.join(SCOPES)}"}), 400
+    terms = literal_terms(raw_query)
+
+    results = {}
+    try:
+        if scope in ("", "journal"):
+            results["journal"] = search_journal(user_id, query, terms, limit)
+        if scope in ("", "chat"):
+            results["chat"] = search_chat(user_id, query, terms, limit)
+    except ExecutionTimeout:
+        return jsonify({"error": "Search took too long, try more specific words"}), 503
+
+    return jsonify({"query": query, **results})
@@ -0,0 +1,67 @@
+import os
+import time
+from metrics import Histogram
+
+# Tokens are batched into one SSE frame until either limit is reached
+FLUSH_MAX_BYTES = int(os.getenv("SSE_FLUSH_MAX_BYTES", "256"))
+FLUSH_MAX_MS = float(os.getenv("SSE_FLUSH_MAX_MS", "50"))
+
+frames_per_reply = Histogram("chat_sse_frames_per_reply", "SSE frames sent per chat reply",
+                             buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000))
+bytes_per_frame = Histogram("chat_sse_bytes_per_frame", "Payload bytes per SSE frame",
+                            buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096))
+
+
+def format_event(text, event=None):
+    """Encode text as one SSE event; embedded newlines become extra data lines"""
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in text.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+class SSEWriter:
+    """Coalesces streamed model tokens into SSE frames.
+
+    write() returns a frame to send, or None while tokens are still being
+    batched; close() returns whatever is left. The full reply is kept as a
+    list of chunks and joined once.
+    """
+
+    def __init__(self, max_bytes=FLUSH_MAX_BYTES, max_ms=FLUSH_MAX_MS):
+        self.max_bytes = max_bytes
+        self.max_seconds = max_ms / 1000
+        self.frames = 0
+        self._chunks = []
+        self._pending = []
+        self._pending_bytes = 0
+        self._last_flush = time.monotonic()
+
+    @property
+    def reply(self):
+        return "".join(self._chunks)
+
+    def write(self, chunk):
+        if not chunk:
+            return None
+        self._chunks.append(chunk)
+        self._pending.append(chunk)
+        self._pending_bytes += len(chunk)
+        if self._pending_bytes >= self.max_bytes or time.monotonic() - self._last_flush >= self.max_seconds:
+            return self.flush()
+        return None
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return None
+        text = "".join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        self.frames += 1
+        bytes_per_frame.observe(len(text.encode("utf-8")))
+        return format_event(text)
+
+    def close(self):
+        frame = self.flush()
+        frames_per_reply.observe(self.frames)
+        return frame
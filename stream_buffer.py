@@ -0,0 +1,145 @@
+import os
+import time
+import uuid
+import asyncio
+import threading
+
+# How long a finished reply stays available for reconnecting clients
+STREAM_BUFFER_TTL = int(os.getenv("CHAT_STREAM_BUFFER_TTL", "300"))  # seconds
+STREAM_WAIT_TIMEOUT = float(os.getenv("CHAT_STREAM_WAIT_TIMEOUT", "15"))
+# How long generation continues with no client attached before it is cancelled
+STREAM_RESUME_GRACE = float(os.getenv("CHAT_STREAM_RESUME_GRACE", "10"))  # seconds
+
+
+class ReplayBuffer:
+    """SSE frames of one in-progress reply, readable from any offset.
+
+    The producer appends frames as the model streams; readers (the original
+    request or a reconnect) wait for frames past their offset. Works for
+    thread readers and asyncio readers alike.
+    """
+
+    def __init__(self, user_id):
+        self.stream_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.frames = []
+        self.done = False
+        self.updated_at = time.monotonic()
+        self.chunks = 0  # model stream chunks received so far (one per Ollama frame)
+        self.readers = 0
+        self.detached_at = None
+        self.chunks_at_detach = 0
+        self._cond = threading.Condition()
+        self._async_waiters = set()
+
+    def append(self, frame):
+        with self._cond:
+            self.frames.append(frame)
+            self._notify()
+
+    def close(self):
+        with self._cond:
+            self.done = True
+            self._notify()
+
+    def attach(self):
+        with self._cond:
+            self.readers += 1
+            self.detached_at = None
+
+    def detach(self):
+        with self._cond:
+            self.readers -= 1
+            if self.readers == 0 and not self.done:
+                self.detached_at = time.monotonic()
+                self.chunks_at_detach = self.chunks
+
+    def abandoned(self):
+        """True once nobody has been reading for longer than the resume grace period"""
+        with self._cond:
+            return (self.readers == 0 and self.detached_at is not None
+                    and time.monotonic() - self.detached_at >= STREAM_RESUME_GRACE)
+
+    def _notify(self):
+        self.updated_at = time.monotonic()
+        self._cond.notify_all()
+        for loop, event in list(self._async_waiters):
+            loop.call_soon_threadsafe(event.set)
+
+    def iter_frames(self, offset=0):
+        """Yield (index, frame) from `offset` until the reply is complete"""
+        while True:
+            with self._cond:
+                while len(self.frames) <= offset and not self.done:
+                    self._cond.wait(STREAM_WAIT_TIMEOUT)
+                frames = self.frames[offset:]
+                done = self.done
+            for frame in frames:
+                yield offset, frame
+                offset += 1
+            if done and offset >= len(self.frames):
+                return
+
+    async def aiter_frames(self, offset=0):
+        loop = asyncio.get_running_loop()
+        while True:
+            event = asyncio.Event()
+            waiter = (loop, event)
+            with self._cond:
+                if len(self.frames) <= offset and not self.done:
+                    self._async_waiters.add(waiter)
+                    waiting = True
+                else:
+                    waiting = False
+            if waiting:
+                try:
+                    await asyncio.wait_for(event.wait(), STREAM_WAIT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    with self._cond:
+                        self._async_waiters.discard(waiter)
+            with self._cond:
+                frames = self.frames[offset:]
+                done = self.done
+            for frame in frames:
+                yield offset, frame
+                offset += 1
+            if done and offset >= len(self.frames):
+                return
+
+
+_buffers = {}
+_lock = threading.Lock()
+
+def _evict(now):
+    expired = [sid for sid, b in _buffers.items() if b.done and now - b.updated_at > STREAM_BUFFER_TTL]
+    for stream_id in expired:
+        del _buffers[stream_id]
+
+def create_buffer(user_id):
+    buffer = ReplayBuffer(user_id)
+    with _lock:
+        _evict(time.monotonic())
+        _buffers[buffer.stream_id] = buffer
+    return buffer
+
+def get_buffer(stream_id, user_id):
+    """Return the buffer for a stream owned by `user_id`, or None if it is unknown or expired"""
+    with _lock:
+        _evict(time.monotonic())
+        buffer = _buffers.get(stream_id)
+    if buffer is None or buffer.user_id != user_id:
+        return None
+    return buffer
+
+def parse_last_event_id(value):
+    """Offset to resume from, given the last event id the client saw"""
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+def format_replay_frame(index, frame):
+    # Event ids count delivered frames, so Last-Event-ID is the resume offset
+    return f"id: {index + 1}\n{frame}"
@@ -1,14 +1,24 @@
-
-'''THIS SCRIPT IS ONLY FOR TESTING PURPOSES AND PLAYS NO ROLE IN THE WEBAPP'''
+'''THIS SCRIPT IS ONLY FOR TESTING PURPOSES AND PLAYS NO ROLE IN THE WEBAPP
+For load testing use bench/load_chat.py'''
 import requests
 
-API_URL = "http://localhost:5000/chat"
+BASE_URL = "http://localhost:5000"
+
+username = input("Username: ")
+password = input("Password: ")
+token = requests.post(f"{BASE_URL}/login", json={"username": username, "password": password}).json()["token"]
+headers = {"Authorization": f"Bearer {token}"}
+session_id = requests.post(f"{BASE_URL}/start_session", headers=headers).json()["session_id"]
 
 while True:
     user_input = input("You: ")
     if user_input.lower() in ["exit", "quit"]:
         break
 
-    payload = {"message": user_input}
-    response = requests.post(API_URL, json=payload)
-    
\ No newline at end of file
+    payload = {"message": user_input, "session_id": session_id}
+    with requests.post(f"{BASE_URL}/chat", json=payload, headers=headers, stream=True) as response:
+        print("AI:", end=" ", flush=True)
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("data: "):
+                print(line[len("data: "):], end="", flush=True)
+        print()
@@ -0,0 +1,65 @@
+'''Helpers for $text search: turning user input into literal search terms and
+highlighting those terms in the matched text.
+
+$text treats "quoted phrases" and -negated words as operators; literal_query()
+drops them so any input is just a bag of words, and bounds how many there are.'''
+import os
+import re
+
+MAX_QUERY_TERMS = 8
+MAX_TERM_CHARS = 40
+SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "160"))
+
+_word = re.compile(r"\w+", re.UNICODE)
+_suffixes = ("ing", "es", "ed", "ly", "s")
+
+
+def literal_terms(query):
+    """Distinct lower-cased words of the query, in order"""
+    terms = []
+    for word in _word.findall(query.lower()):
+        word = word[:MAX_TERM_CHARS]
+        if word not in terms:
+            terms.append(word)
+        if len(terms) == MAX_QUERY_TERMS:
+            break
+    return terms
+
+
+def literal_query(query):
+    """A $text $search string matching any of the query's words, or "" if it has none"""
+    return " ".join(literal_terms(query))
+
+
+def _stem(word):
+    # Close enough to the server's stemmer to decide what to highlight
+    for suffix in _suffixes:
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            word = word[:-len(suffix)]
+            # running -> run
+            if len(word) > 2 and word[-1] == word[-2]:
+                word = word[:-1]
+            break
+    return word
+
+
+def highlight(text, terms, max_chars=None):
+    """Snippet of `text` around the first matching word, plus [start, end) offsets of every match in it.
+
+    Offsets are returned rather than markup so clients never have to render stored text as HTML.
+    """
+    stems = {_stem(t) for t in terms}
+    matches = [(m.start(), m.end()) for m in _word.finditer(text) if _stem(m.group().lower()) in stems]
+    if max_chars is None or len(text) <= max_chars:
+        return {"text": text, "matches": [list(m) for m in matches]}
+
+    start = max(0, matches[0][0] - max_chars // 4) if matches else 0
+    end = min(len(text), start + max_chars)
+    start = max(0, end - max_chars)
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    shift = len(prefix) - start
+    return {
+        "text": prefix + text[start:end] + suffix,
+        "matches": [[s + shift, e + shift] for s, e in matches if s >= start and e <= end]
+    }